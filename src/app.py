@@ -1,29 +1,67 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory, send_file, Response, session, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, Response, session, flash
 from flask_socketio import SocketIO, emit
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
 import os
 import io
 import json as json_module
-import tempfile
 import base64
 import time
 import uuid
+import struct
 import hashlib
 import secrets
 import html as html_module
 import re
 import logging
+import itertools
 import eventlet
-import requests as http_requests
-from collections import defaultdict
-from functools import wraps
+import eventlet.event
+import eventlet.tpool
+import httpx
+from collections import defaultdict, OrderedDict
+from functools import wraps, lru_cache
 import openpyxl
 from voice.openai_voice import transcribe_audio_whisper, synthesize_speech_openai
-from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone, timedelta
 
+try:
+    import ahocorasick  # Optional: single-pass multi-phrase matching for injection detection
+except ImportError:
+    ahocorasick = None
+
+try:
+    import blake3  # Optional: SIMD-accelerated hashing for TTS cache keys
+except ImportError:
+    blake3 = None
+
+try:
+    import h2  # noqa: F401  Optional: lets httpx multiplex OpenAI calls over one HTTP/2 connection
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import orjson  # Optional: C JSON encoder for Socket.IO packets
+except ImportError:
+    orjson = None
+
+try:
+    import tiktoken  # Optional: exact token counts for history budgeting
+except ImportError:
+    tiktoken = None
+
+try:
+    import re2  # Optional: linear-time (no backtracking) engine for the injection regex fallback
+except ImportError:
+    re2 = None
+
+try:
+    from python_calamine import CalamineWorkbook  # Optional: fast native xlsx reader for the KB
+except ImportError:
+    CalamineWorkbook = None
+
 # ============================================================
 # ENTERPRISE MODULES: Import enterprise infrastructure
 # ============================================================
@@ -68,7 +106,7 @@ app.config['SECRET_KEY'] = config.SECRET_KEY
 # ============================================================
 # USER AUTH: SQLite database for user registration & login
 # ============================================================
-USER_DB_PATH = os.path.join(BASE_DIR, '..', 'data', 'users.db')
+USER_DB_PATH = os.getenv('USER_DB_PATH', os.path.join(BASE_DIR, '..', 'data', 'users.db'))
 os.makedirs(os.path.dirname(USER_DB_PATH), exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{USER_DB_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -143,21 +181,70 @@ init_middleware(app, config)
 # ============================================================
 ALLOWED_ORIGINS = config.get_allowed_origins()
 
+
+class OrjsonPacketSerializer:
+    """json-module shim so python-socketio encodes every emit with orjson."""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')  # Packets are str; orjson output is compact already
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+
+socketio_options = {'json': OrjsonPacketSerializer} if orjson is not None else {}
+if config.SOCKETIO_MESSAGE_QUEUE:
+    # Fan out emits across workers through Redis pub/sub
+    socketio_options['message_queue'] = config.SOCKETIO_MESSAGE_QUEUE
+
 socketio = SocketIO(
     app,
     max_http_buffer_size=config.SOCKET_MAX_BUFFER,
     cors_allowed_origins=ALLOWED_ORIGINS,
-    async_mode='eventlet'
+    async_mode='eventlet',
+    **socketio_options
+)
+
+# Shared keep-alive pool to api.openai.com (HTTP/2 when h2 is installed) so moderation,
+# chat, TTS and the raw Realtime calls reuse warm connections instead of new TLS handshakes
+openai_http = DefaultHttpxClient(
+    http2=HTTP2_AVAILABLE,
+    limits=httpx.Limits(
+        max_connections=config.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.OPENAI_KEEPALIVE_EXPIRY,
+    ),
 )
 
 # Initialize OpenAI client
-client = OpenAI(api_key=config.OPENAI_API_KEY)
+client = OpenAI(
+    api_key=config.OPENAI_API_KEY,
+    timeout=httpx.Timeout(config.OPENAI_TIMEOUT, connect=config.OPENAI_CONNECT_TIMEOUT),
+    http_client=openai_http,
+)
+
+
+def _warm_openai_pool():
+    """Open the first TLS connection at startup so the first user turn skips the handshake.
+    Also loads the tiktoken encoding, which may need a download, off the request path."""
+    try:
+        client.models.retrieve(config.OPENAI_CHAT_MODEL)
+        logger.info("OpenAI connection pool warmed")
+    except Exception as e:
+        logger.warning(f"OpenAI warm-up failed: {e}")
+    _get_token_encoding()
+
+
+if config.OPENAI_WARMUP and config.OPENAI_API_KEY:
+    eventlet.spawn(_warm_openai_pool)
 
 # ============================================================
 # STREAMING & CANCELLATION: Active generation tracking
 # ============================================================
 active_generations = {}  # {sid: {'cancelled': bool}}
-processing_lock = {}     # {sid: True} — prevents concurrent responses per session
+processing_lock = {}     # {sid: owner token} — prevents concurrent responses per session
 
 
 def get_cancellation_token(sid):
@@ -168,6 +255,12 @@ def get_cancellation_token(sid):
     return token
 
 
+def release_cancellation_token(sid, token):
+    """Drop a finished generation's token, unless a newer generation already replaced it."""
+    if active_generations.get(sid) is token:
+        active_generations.pop(sid, None)
+
+
 def cancel_generation(sid):
     """Cancel any active LLM/TTS generation for a session."""
     if sid in active_generations:
@@ -182,6 +275,7 @@ def cancel_generation(sid):
 MAX_SESSIONS = config.MAX_SESSIONS
 MAX_TEXT_LENGTH = config.MAX_TEXT_LENGTH
 MAX_AUDIO_SIZE = config.MAX_AUDIO_SIZE
+MAX_AUDIO_B64_SIZE = (MAX_AUDIO_SIZE + 2) // 3 * 4  # base64 length of a MAX_AUDIO_SIZE payload
 SESSION_TIMEOUT = config.SESSION_TIMEOUT
 
 # ============================================================
@@ -190,15 +284,26 @@ SESSION_TIMEOUT = config.SESSION_TIMEOUT
 TTS_CACHE_MAX_SIZE = config.TTS_CACHE_MAX_SIZE
 
 
+def normalize_tts_text(text, mode):
+    """Fold spacing and trailing ./!/, so near-identical replies share cached audio.
+    Case and '?' are kept (acronyms like 'IT', question intonation); modes outside
+    TTS_CACHE_NORMALIZED_MODES (e.g. language practice) stay exact."""
+    if mode not in config.TTS_CACHE_NORMALIZED_MODES:
+        return text
+    return ' '.join(text.split()).rstrip('.!,')
+
+
 def get_tts_cache_key(text, voice, mode):
-    """Generate a hash key for TTS caching."""
-    raw = f"{text}|{voice}|{mode}"
-    return hashlib.md5(raw.encode()).hexdigest()
+    """Generate a 128-bit hash key for TTS caching (BLAKE3 when installed, else BLAKE2b)."""
+    raw = f"{normalize_tts_text(text, mode)}|{voice}|{mode}".encode()
+    if blake3 is not None:
+        return blake3.blake3(raw).hexdigest(length=16)
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
 
 
-def get_cached_tts(text, voice, mode):
+def get_cached_tts(text, voice, mode, key=None):
     """Get TTS audio from cache if available."""
-    key = get_tts_cache_key(text, voice, mode)
+    key = key or get_tts_cache_key(text, voice, mode)
     cached = redis_store.get_tts_cache(key)
     if cached:
         record_tts_cache_hit()
@@ -206,10 +311,10 @@ def get_cached_tts(text, voice, mode):
     return None
 
 
-def store_tts_cache(text, voice, mode, audio_b64):
-    """Store TTS audio in cache."""
-    key = get_tts_cache_key(text, voice, mode)
-    redis_store.set_tts_cache(key, audio_b64, TTS_CACHE_MAX_SIZE)
+def store_tts_cache(text, voice, mode, audio, key=None):
+    """Store TTS audio bytes in cache."""
+    key = key or get_tts_cache_key(text, voice, mode)
+    redis_store.set_tts_cache(key, audio, TTS_CACHE_MAX_SIZE)
     record_tts_cache_miss()
 
 
@@ -252,37 +357,183 @@ PROMPT_INJECTION_PATTERNS = [
 ]
 
 
+# Literal phrase forms of PROMPT_INJECTION_PATTERNS, matched against text with
+# whitespace runs collapsed to a single space. Tuple parts are alternatives.
+PROMPT_INJECTION_PHRASES = [
+    ('ignore ', ('', 'all '), ('previous instructions', 'above')),
+    ('you are now a',),
+    ('new instruction', ('', 's'), ('', ' '), ':'),
+    ('system', ('', ' '), ':'),
+    ('forget ', ('everything', 'all', 'your'), ' ', ('you', 'instructions', 'rules')),
+    ('override ', ('your', 'the'), ' ', ('system', 'instructions', 'rules', 'prompt')),
+    ('disregard ', ('your', 'the', 'all', 'previous')),
+    ('pretend you are',),
+    ('act as if you ', ('are', 'were'), ' not'),
+    ('do not follow ', ('your', 'the')),
+    ('reveal ', ('your', 'the'), ' ', ('system', 'instructions', 'prompt')),
+    ('what ', ('is', 'are'), ' your ', ('system', 'instructions', 'prompt', 'rules')),
+]
+
+# All patterns fused into one alternation so the fallback scans the text once.
+# Text with any non-ASCII character goes through stdlib re: its \s covers NBSP and other
+# Unicode whitespace and (?i) folds letters like 'İ' and 'ſ', neither of which RE2 does.
+_INJECTION_PATTERN = '(?i)' + '|'.join(f'(?:{p})' for p in PROMPT_INJECTION_PATTERNS)
+_INJECTION_RE = re.compile(_INJECTION_PATTERN)
+# Pure-ASCII text (most input) spells out what Unicode \s matches within ASCII, so RE2
+# (linear time, no backtracking) or sre's cheaper ASCII mode give the same verdicts
+_INJECTION_PATTERN_ASCII = _INJECTION_PATTERN.replace(r'\s', r'[\t-\r\x1c-\x20]')
+_INJECTION_RE_ASCII = (
+    re2.compile(_INJECTION_PATTERN_ASCII) if re2 is not None
+    else re.compile(_INJECTION_PATTERN_ASCII, re.ASCII)
+)
+# One word every pattern must contain; ASCII text with none of them cannot match
+_INJECTION_TRIGGERS = (
+    'ignore', 'now', 'instruction', 'system', 'forget', 'override', 'disregard',
+    'pretend', 'act', 'follow', 'reveal', 'prompt', 'rules',
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _expand_phrase(parts):
+    """Expand a phrase spec into every literal string it can match."""
+    options = [(part,) if isinstance(part, str) else part for part in parts]
+    return [''.join(combo) for combo in itertools.product(*options)]
+
+
+def _build_injection_automaton():
+    """Build an Aho-Corasick automaton over all injection phrases (None if unavailable)."""
+    if ahocorasick is None:
+        logger.info("pyahocorasick not installed — using regex prompt injection scan")
+        return None
+    automaton = ahocorasick.Automaton()
+    for parts in PROMPT_INJECTION_PHRASES:
+        for phrase in _expand_phrase(parts):
+            automaton.add_word(phrase, phrase)
+    automaton.make_automaton()
+    return automaton
+
+
+_INJECTION_AUTOMATON = _build_injection_automaton()
+
+
+@lru_cache(maxsize=4096)
 def detect_prompt_injection(text):
-    """Check if text contains prompt injection attempts."""
-    text_lower = text.lower().strip()
-    for pattern in PROMPT_INJECTION_PATTERNS:
-        if re.search(pattern, text_lower):
-            return True
-    return False
+    """Check if text contains prompt injection attempts.
+    ASCII text gets a single Aho-Corasick pass over whitespace-normalized text,
+    or the ASCII regex when pyahocorasick is not installed. Anything else uses
+    the Unicode stdlib pattern, whose case folding str.lower() can't reproduce."""
+    if not text.isascii():
+        return _INJECTION_RE.search(text) is not None
+
+    if _INJECTION_AUTOMATON is not None:
+        normalized = _WHITESPACE_RE.sub(' ', text.lower())
+        return any(True for _ in _INJECTION_AUTOMATON.iter(normalized))
+
+    # Callers pass sanitize_text_input output, already stripped
+    text_lower = text.lower()
+    if not any(trigger in text_lower for trigger in _INJECTION_TRIGGERS):
+        return False
+    return _INJECTION_RE_ASCII.search(text) is not None
+
+
+# Moderation verdicts keyed by BLAKE2b digest of the case/whitespace-folded text, kept in
+# LRU order: {digest: (expires_at, flagged, categories)}.
+# Repeated utterances ("yes", "Go on.", retries) skip the API round-trip until the TTL lapses.
+_moderation_cache = OrderedDict()
+
+
+def _moderation_cache_key(text):
+    return hashlib.blake2b(' '.join(text.lower().split()).encode('utf-8'), digest_size=16).digest()
+
+
+# Short conversational turns that can never be flagged; skip the API call for these
+MODERATION_SAFE_PHRASES = frozenset({
+    "ok", "yes", "no", "repeat", "wait", "stop", "hold on", "skip",
+    "i don't know", "what?", "hmm", "go on", "hello", "hi",
+})
+
+
+# Category fields on the SDK's moderation result, checked by name instead of walking __dict__
+MODERATION_CATEGORIES = (
+    "harassment", "harassment_threatening", "hate", "hate_threatening",
+    "illicit", "illicit_violent", "self_harm", "self_harm_instructions",
+    "self_harm_intent", "sexual", "sexual_minors", "violence", "violence_graphic",
+)
+
+# Cache misses queue here as (text, Event); one flusher greenthread sends them to
+# the moderation endpoint in batches so concurrent users share a round-trip.
+_moderation_pending = []
+_moderation_flusher = None
+
+
+def _flush_moderation_batches():
+    """Coalesce queued moderation requests into array calls and fan the results back out."""
+    global _moderation_flusher
+    eventlet.sleep(config.MODERATION_BATCH_WINDOW)
+    while _moderation_pending:
+        batch = _moderation_pending[:config.MODERATION_BATCH_MAX]
+        del _moderation_pending[:config.MODERATION_BATCH_MAX]
+        try:
+            response = client.moderations.create(input=[text for text, _ in batch])
+            for (_, done), result in zip(batch, response.results):
+                done.send(result)
+        except Exception as e:
+            for _, done in batch:
+                done.send_exception(e)
+    _moderation_flusher = None
+
+
+def _request_moderation(text):
+    """Queue text for the next moderation batch and wait for its result."""
+    global _moderation_flusher
+    done = eventlet.event.Event()
+    _moderation_pending.append((text, done))
+    if _moderation_flusher is None:
+        _moderation_flusher = eventlet.spawn(_flush_moderation_batches)
+    return done.wait()
 
 
 def moderate_content(text):
-    """Use OpenAI's moderation API to check for harmful content."""
+    """Use OpenAI's moderation API to check for harmful content.
+    Results are cached by content hash with TTL eviction since moderation policy can evolve."""
+    if len(text) < 13 and text.lower() in MODERATION_SAFE_PHRASES:
+        return False, []
+
+    key = _moderation_cache_key(text)
+    cached = _moderation_cache.get(key)
+    if cached and cached[0] > time.time():
+        _moderation_cache.move_to_end(key)
+        return cached[1], cached[2]
+
     try:
-        response = client.moderations.create(input=text)
-        result = response.results[0]
+        result = _request_moderation(text)
+        flagged_cats = []
         if result.flagged:
             # Get flagged categories
-            flagged_cats = [cat for cat, flagged in result.categories.__dict__.items() if flagged]
-            return True, flagged_cats
-        return False, []
+            categories = result.categories
+            flagged_cats = [cat for cat in MODERATION_CATEGORIES if getattr(categories, cat, False)]
+            if not flagged_cats:
+                # Flagged under a category this list does not know about yet
+                flagged_cats = [cat for cat, flagged in categories.__dict__.items() if flagged]
+                logger.warning(f"Moderation flagged unknown categories: {flagged_cats}")
+
+        _moderation_cache.pop(key, None)
+        if len(_moderation_cache) >= config.MODERATION_CACHE_MAX_SIZE:
+            _moderation_cache.popitem(last=False)  # Evict least recently used
+        _moderation_cache[key] = (time.time() + config.MODERATION_CACHE_TTL, result.flagged, flagged_cats)
+        return result.flagged, flagged_cats
     except Exception as e:
         logger.warning(f"Moderation API error: {e}")
         return False, []  # Fail open — don't block if moderation API is down
 
 
 def sanitize_text_input(text):
-    """Sanitize user text input."""
+    """Sanitize user text input. The result is stripped once here; downstream
+    checks (detect_prompt_injection, moderate_content) rely on that."""
     if not isinstance(text, str):
         return ""
     # Strip and limit length
-    text = text.strip()[:MAX_TEXT_LENGTH]
-    return text
+    return text.strip()[:MAX_TEXT_LENGTH]
 
 # Supported languages
 SUPPORTED_LANGUAGES = {
@@ -500,6 +751,27 @@ REALTIME_HELPDESK_PROMPT = REALTIME_HELPDESK_PROMPT_TEMPLATE.format(
     persona_greeting="Hey there, I'm Sam from IT support! What seems to be the trouble today?"
 )
 
+# Persona templates split once at import into literal chunks and placeholder names
+# (odd indices), so filling one per session is a join instead of a .format() scan
+_PERSONA_PLACEHOLDER_RE = re.compile(r'\{(persona_name|persona_title|persona_greeting)\}')
+REALTIME_PERSONA_TEMPLATES = {
+    'interview': _PERSONA_PLACEHOLDER_RE.split(REALTIME_INTERVIEW_PROMPT_TEMPLATE),
+    'helpdesk': _PERSONA_PLACEHOLDER_RE.split(REALTIME_HELPDESK_PROMPT_TEMPLATE),
+}
+
+
+@lru_cache(maxsize=64)
+def realtime_persona_prompt(mode, persona_name, persona_title, persona_greeting):
+    """Render the Realtime prompt for a persona from its pre-split template.
+    The frontend offers a fixed set of personas, so the same few renders repeat."""
+    values = {
+        'persona_name': persona_name,
+        'persona_title': persona_title,
+        'persona_greeting': persona_greeting,
+    }
+    parts = REALTIME_PERSONA_TEMPLATES[mode]
+    return ''.join([values[part] if i % 2 else part for i, part in enumerate(parts)])
+
 REALTIME_LANGUAGE_PROMPT = """# Role & Objective
 You are a friendly native {language} speaker having a casual voice conversation with someone practicing {language}.
 
@@ -519,6 +791,12 @@ Deliver your audio response fast, but do not sound rushed.
 # Variety
 - Do not repeat the same sentence twice. Vary your responses so it doesn't sound robotic."""
 
+# Realtime language prompt per supported language code, filled in once at import
+REALTIME_LANGUAGE_PROMPTS = {
+    code: REALTIME_LANGUAGE_PROMPT.format(language=name)
+    for code, name in SUPPORTED_LANGUAGES.items()
+}
+
 LANGUAGE_SYSTEM_PROMPT = """You are a native {language} speaker. You're having a real, 
 natural conversation with someone who is practicing their {language}.
 
@@ -578,45 +856,97 @@ Always respond in {language}."""
 # ============================================================
 # IT HELPDESK: Knowledge Base Loading
 # ============================================================
+KB_ROW_TEMPLATE = (
+    "[{}] Category: {} > {} | Priority: {}\n"
+    "Issue: {}\n"
+    "Common Cause: {}\n"
+    "Resolution:\n{}\n"
+    "Estimated Time: {}\n"
+)
+
+
+KB_PATH = os.path.join(BASE_DIR, 'data', 'it_helpdesk_kb.xlsx')
+# Parsed KB text snapshot, reused until the xlsx mtime changes (skips openpyxl on restarts)
+KB_CACHE_PATH = os.path.join(BASE_DIR, 'data', 'it_helpdesk_kb.cache.json')
+# Bump when the row formatting in load_helpdesk_kb changes. The row template and the
+# xlsx reader (calamine and openpyxl render cells differently) are folded in as well.
+KB_CACHE_VERSION = 1
+_KB_READER = 'calamine' if CalamineWorkbook is not None else 'openpyxl'
+_KB_CACHE_FORMAT = hashlib.blake2b(
+    f"{KB_CACHE_VERSION}|{_KB_READER}|{KB_ROW_TEMPLATE}".encode('utf-8'), digest_size=8
+).hexdigest()
+
+
+def _read_kb_cache(kb_mtime):
+    """Return cached KB text if the snapshot matches the xlsx mtime and cache format, else None."""
+    try:
+        with open(KB_CACHE_PATH, encoding='utf-8') as f:
+            cached = json_module.load(f)
+        if cached.get('mtime') == kb_mtime and cached.get('format') == _KB_CACHE_FORMAT:
+            return cached.get('kb_text')
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _write_kb_cache(kb_mtime, kb_text):
+    """Atomically write the KB text snapshot next to the xlsx."""
+    tmp_path = f"{KB_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json_module.dump({'mtime': kb_mtime, 'format': _KB_CACHE_FORMAT, 'kb_text': kb_text}, f)
+        os.replace(tmp_path, KB_CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"Could not write IT Helpdesk KB cache: {e}")
+
+
+def _read_kb_rows(path):
+    """Read KB data rows (header skipped). Uses the Rust-backed python-calamine
+    reader when installed, otherwise openpyxl. Returns None if there is no sheet."""
+    if CalamineWorkbook is not None:
+        return CalamineWorkbook.from_path(path).get_sheet_by_index(0).to_python()[1:]
+
+    wb = openpyxl.load_workbook(path, read_only=True)
+    ws = wb.active
+    if ws is None:
+        wb.close()
+        return None
+    rows = list(ws.iter_rows(min_row=2, values_only=True))  # Skip header
+    wb.close()
+    return rows
+
+
 def load_helpdesk_kb():
-    """Load IT Helpdesk Knowledge Base from Excel file at startup."""
-    kb_path = os.path.join(os.path.dirname(__file__), 'data', 'it_helpdesk_kb.xlsx')
-    if not os.path.exists(kb_path):
-        logger.warning(f"IT Helpdesk KB not found at {kb_path}")
+    """Load IT Helpdesk Knowledge Base from Excel file at startup.
+    Uses the on-disk snapshot when the xlsx is unchanged since it was written."""
+    if not os.path.exists(KB_PATH):
+        logger.warning(f"IT Helpdesk KB not found at {KB_PATH}")
         return "No knowledge base loaded."
 
+    kb_mtime = os.stat(KB_PATH).st_mtime_ns
+    kb_text = _read_kb_cache(kb_mtime)
+    if kb_text is not None:
+        logger.info(f"IT Helpdesk KB loaded from cache: {len(kb_text)} chars")
+        return kb_text
+
     try:
-        wb = openpyxl.load_workbook(kb_path, read_only=True)
-        ws = wb.active
-        if ws is None:
-            wb.close()
+        rows = _read_kb_rows(KB_PATH)
+        if rows is None:
             return "No active worksheet found."
-        rows = list(ws.iter_rows(min_row=2, values_only=True))  # Skip header
-        wb.close()
 
         kb_text_parts = []
         for row in rows:
             if not row or not row[0]:
                 continue
-            incident_id = row[0] or ""
-            category = row[1] or ""
-            sub_category = row[2] or ""
-            issue = row[3] or ""
-            resolution = row[4] or ""
-            priority = row[5] or ""
-            cause = row[6] or ""
-            est_time = row[7] or ""
-
-            kb_text_parts.append(
-                f"[{incident_id}] Category: {category} > {sub_category} | Priority: {priority}\n"
-                f"Issue: {issue}\n"
-                f"Common Cause: {cause}\n"
-                f"Resolution:\n{resolution}\n"
-                f"Estimated Time: {est_time}\n"
-            )
+            # Columns: id, category, sub-category, issue, resolution, priority, cause, est. time
+            kb_text_parts.append(KB_ROW_TEMPLATE.format(
+                row[0], row[1] or "", row[2] or "", row[5] or "",
+                row[3] or "", row[6] or "", row[4] or "", row[7] or "",
+            ))
 
         kb_text = "\n---\n".join(kb_text_parts)
         logger.info(f"IT Helpdesk KB loaded: {len(rows)} incidents, {len(kb_text)} chars")
+        _write_kb_cache(kb_mtime, kb_text)
         return kb_text
     except Exception as e:
         logger.error(f"Error loading IT Helpdesk KB: {e}", exc_info=True)
@@ -722,6 +1052,32 @@ you get things sorted out quickly!"
 """
 
 
+def _compact_prompt(text):
+    """Drop trailing spaces on each line and surrounding blank lines; they only cost tokens."""
+    return '\n'.join(line.rstrip() for line in text.strip().split('\n'))
+
+
+INTERVIEW_SYSTEM_PROMPT = _compact_prompt(INTERVIEW_SYSTEM_PROMPT)
+IT_HELPDESK_SYSTEM_PROMPT = _compact_prompt(IT_HELPDESK_SYSTEM_PROMPT)
+LANGUAGE_SYSTEM_PROMPT = _compact_prompt(LANGUAGE_SYSTEM_PROMPT)
+
+# Opening system message per mode, built once. These dicts are shared between
+# sessions and must not be mutated; history code only ever replaces messages[0].
+INTERVIEW_SYSTEM_MESSAGE = {"role": "system", "content": INTERVIEW_SYSTEM_PROMPT}
+IT_HELPDESK_SYSTEM_MESSAGE = {"role": "system", "content": IT_HELPDESK_SYSTEM_PROMPT}
+LANGUAGE_SYSTEM_MESSAGES = {
+    code: {"role": "system", "content": LANGUAGE_SYSTEM_PROMPT.format(language=name)}
+    for code, name in SUPPORTED_LANGUAGES.items()
+}
+
+# Redis sessions store these as short references instead of the full prompt text
+redis_store.register_shared_messages({
+    'system:interview': INTERVIEW_SYSTEM_MESSAGE,
+    'system:helpdesk': IT_HELPDESK_SYSTEM_MESSAGE,
+    **{f'system:language:{code}': message for code, message in LANGUAGE_SYSTEM_MESSAGES.items()},
+})
+
+
 def get_session_id() -> str:
     return getattr(request, 'sid', '') or ''  # type: ignore[attr-defined]
 
@@ -738,6 +1094,7 @@ def get_conversation(sid):
         'session_start': time.time(),
         'emotional_tone': 'neutral',
         'last_assistant_partial': '',
+        'summary': '',            # Rolling summary of turns evicted from messages
         'conversation_id': None,  # PostgreSQL conversation ID for persistence
         'user_id': None,          # JWT-authenticated user ID
     }
@@ -751,83 +1108,181 @@ def save_conversation(sid, conv):
     redis_store.set_session(sid, conv)
 
 
-def summarize_old_messages(messages):
-    """Use LLM to compress old conversation into a concise context summary."""
-    if len(messages) <= 1:
-        return ""
-    # Extract conversation text for compression
-    old_text = []
-    for msg in messages:
-        if msg['role'] == 'user':
-            old_text.append(f"User: {msg['content'][:300]}")
-        elif msg['role'] == 'assistant':
-            old_text.append(f"Assistant: {msg['content'][:300]}")
+def log_message_async(*args, **kwargs):
+    """Write a conversation message to the database in a background task.
+    Nothing in the reply depends on the row, so the turn doesn't wait on the DB commit."""
+    def _write():
+        with app.app_context():
+            db_module.log_message(*args, **kwargs)
+    socketio.start_background_task(_write)
 
-    conversation_excerpt = "\n".join(old_text[-12:])
 
-    try:
-        summary_response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a conversation summarizer. Compress the following conversation excerpt into a concise 3-5 sentence summary. Capture: key topics discussed, the user's background/expertise level, any important facts they mentioned, and the emotional tone of the exchange. Be factual and brief."},
-                {"role": "user", "content": conversation_excerpt}
-            ],
-            max_tokens=150,
-            temperature=0.3
-        )
-        summary = summary_response.choices[0].message.content
-        return f"CONVERSATION CONTEXT (compressed summary of earlier exchanges):\n{summary}"
-    except Exception as e:
-        logger.warning(f"Summary generation failed: {e}")
-        # Fallback to simple extraction
-        return "EARLIER IN THIS CONVERSATION:\n" + "\n".join(old_text[-8:])
+SUMMARY_MAX_CHARS = 1500  # Rolling summary cap; oldest text is dropped first
+
+# tiktoken encoding, loaded on first use (it may need to download its BPE file).
+# Stays None if tiktoken is missing; a failed load is retried after
+# TOKEN_ENCODING_RETRY_SECONDS, and counts are estimated meanwhile.
+TOKEN_ENCODING_RETRY_SECONDS = 300
+_token_encoding = None
+_token_encoding_retry_at = 0.0
+
+
+def _get_token_encoding():
+    global _token_encoding, _token_encoding_retry_at
+    if _token_encoding is None and tiktoken is not None and time.time() >= _token_encoding_retry_at:
+        # Set before loading so concurrent callers estimate instead of repeating the download
+        _token_encoding_retry_at = time.time() + TOKEN_ENCODING_RETRY_SECONDS
+        try:
+            try:
+                _token_encoding = tiktoken.encoding_for_model(config.OPENAI_CHAT_MODEL)
+            except KeyError:
+                _token_encoding = tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating token counts: {e}")
+    return _token_encoding
+
+
+@lru_cache(maxsize=8192)
+def _count_encoded_tokens(text):
+    return len(_token_encoding.encode(text))
+
+
+def count_tokens(text):
+    """Token count for a message body (about 4 chars per token without tiktoken).
+    Exact counts are cached by content, so history is not re-tokenized every turn.
+    Estimates are not cached: they are cheap, and would outlive a later successful load."""
+    if _get_token_encoding() is None:
+        return len(text) // 4 + 1
+    return _count_encoded_tokens(text)
+
+
+def compress_history(conv):
+    """Evict the oldest messages into a rolling summary once the history exceeds the
+    message threshold or HISTORY_TOKEN_BUDGET tokens.
+    Each evicted turn is appended to conv['summary'] once, so the cost per turn is
+    independent of session length. messages[0] (the system prompt) is never evicted,
+    nor is the latest message."""
+    messages = conv['messages']
+    compression_threshold = config.MEMORY_COMPRESSION_THRESHOLD
+    token_budget = config.HISTORY_TOKEN_BUDGET
+    # ~4 tokens of per-message overhead on top of the content
+    history_tokens = sum(count_tokens(msg['content']) + 4 for msg in messages[1:])
+    if len(messages) <= compression_threshold and history_tokens <= token_budget:
+        return
+
+    parts = [conv.get('summary', '')]
+    while len(messages) > 2 and (len(messages) > compression_threshold or history_tokens > token_budget):
+        msg = messages.pop(1)
+        history_tokens -= count_tokens(msg['content']) + 4
+        if msg['role'] == 'user':
+            parts.append(f"User said: {msg['content'][:100]} | ")
+        elif msg['role'] == 'assistant':
+            parts.append(f"Assistant discussed: {msg['content'][:100]} | ")
+    summary = ''.join(parts)
+    conv['summary'] = summary[-SUMMARY_MAX_CHARS:]
+
+
+def build_llm_messages(conv):
+    """Messages to send to the LLM: the history plus the rolling summary (if any).
+    The summary goes in its own system message so the static system prompt prefix is unchanged."""
+    summary = conv.get('summary')
+    if not summary:
+        return conv['messages']
+    summary_msg = {"role": "system", "content": f"EARLIER IN THIS CONVERSATION:\n{summary}"}
+    return [conv['messages'][0], summary_msg] + conv['messages'][1:]
+
+
+# Tone keywords in priority order; the first tone with any keyword in the exchange wins
+EMOTIONAL_TONE_KEYWORDS = (
+    ('empathetic', ('frustrated', 'annoying', 'broken', 'not working', 'angry', 'terrible', 'awful')),
+    ('enthusiastic', ('great', 'excellent', 'brilliant', 'perfect', 'awesome', 'well done', 'spot on')),
+    ('curious', ('hmm', 'interesting', 'curious', 'tell me more', 'elaborate', 'how')),
+    ('serious', ('important', 'critical', 'serious', 'compliance', 'security', 'risk')),
+    ('encouraging', ('challenge', 'struggle', 'difficult', 'hard', 'tough')),
+)
 
 
 def detect_emotional_tone(user_text, bot_text):
     """Detect emotional tone from the exchange to adjust TTS delivery."""
     text_lower = (user_text + ' ' + bot_text).lower()
 
-    # Simple rule-based emotional tone detection
-    if any(w in text_lower for w in ['frustrated', 'annoying', 'broken', 'not working', 'angry', 'terrible', 'awful']):
-        return 'empathetic'
-    elif any(w in text_lower for w in ['great', 'excellent', 'brilliant', 'perfect', 'awesome', 'well done', 'spot on']):
-        return 'enthusiastic'
-    elif any(w in text_lower for w in ['hmm', 'interesting', 'curious', 'tell me more', 'elaborate', 'how']):
-        return 'curious'
-    elif any(w in text_lower for w in ['important', 'critical', 'serious', 'compliance', 'security', 'risk']):
-        return 'serious'
-    elif any(w in text_lower for w in ['challenge', 'struggle', 'difficult', 'hard', 'tough']):
-        return 'encouraging'
+    # Simple rule-based emotional tone detection (str 'in' beats a regex alternation here)
+    for tone, keywords in EMOTIONAL_TONE_KEYWORDS:
+        for keyword in keywords:
+            if keyword in text_lower:
+                return tone
     return 'neutral'
 
 
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?…])\s+')
+
+
 def split_into_speech_chunks(text):
     """Split text into natural speech chunks for streaming TTS.
     Splits at sentence boundaries, producing chunks of ~20-80 words for natural delivery."""
-    import re
     # Split on sentence-ending punctuation followed by a space
-    raw_sentences = re.split(r'(?<=[.!?…])\s+', text)
+    raw_sentences = SENTENCE_BOUNDARY_RE.split(text)
     chunks = []
     buffer = ""
+    buffer_words = 0  # Running word count, so the buffer is never re-split
 
     for sentence in raw_sentences:
         sentence = sentence.strip()
         if not sentence:
             continue
+        sentence_words = len(sentence.split())
         # If buffer + sentence is still short, accumulate
-        if buffer and len((buffer + ' ' + sentence).split()) < 25:
+        if buffer and buffer_words + sentence_words < 25:
             buffer += ' ' + sentence
+            buffer_words += sentence_words
         else:
             if buffer:
-                chunks.append(buffer.strip())
+                chunks.append(buffer)
             buffer = sentence
+            buffer_words = sentence_words
 
-    if buffer.strip():
-        chunks.append(buffer.strip())
+    if buffer:
+        chunks.append(buffer)
 
     return chunks if chunks else [text]
 
 
+# Phrases Whisper commonly hallucinates on silent or noisy audio. Real
+# conversational words ('wait', 'thanks', 'bye', ...) must NOT be listed here.
+WHISPER_NOISE = frozenset({
+    'thanks for watching', 'thank you for watching', 'subtitles by',
+    'the end', 'silence', 'applause', 'foreign', 'laughter', 'cheering',
+    'inaudible', 'unintelligible', 'no audio', 'blank audio',
+    'subscribe', 'like and subscribe', 'bell icon',
+    'please subscribe', 'click the bell', 'music',
+})
+
+# Upload file extension by client MIME type (keys are already lowercase)
+AUDIO_MIME_EXT = {
+    'audio/webm': '.webm',
+    'audio/webm;codecs=opus': '.webm',
+    'audio/ogg': '.ogg',
+    'audio/ogg;codecs=opus': '.ogg',
+    'audio/mp4': '.mp4',
+    'audio/mpeg': '.mp3',
+    'audio/wav': '.wav',
+    'audio/x-wav': '.wav',
+    'audio/flac': '.flac',
+}
+
+# Audio container magic numbers (first 4 bytes, big-endian) -> file extension.
+# MP3 has 2-3 byte signatures and is checked separately.
+AUDIO_MAGIC_EXT = {
+    0x1A45DFA3: '.webm',  # WebM/Matroska
+    0x4F676753: '.ogg',   # OggS
+    0x664C6143: '.flac',  # fLaC
+    0x52494646: '.wav',   # RIFF
+    0x0000001C: '.mp4',   # MP4/M4A (ftyp box sizes)
+    0x00000018: '.mp4',
+    0x00000020: '.mp4',
+}
+
+
 def transcribe_audio(audio_bytes, language=None, mime_type=None):
     """Use OpenAI Whisper to transcribe audio to text."""
     # SECURITY: Validate audio size
@@ -835,56 +1290,30 @@ def transcribe_audio(audio_bytes, language=None, mime_type=None):
         raise ValueError("Audio file too large")
 
     # Determine file extension from MIME type or audio magic bytes
-    ext = '.webm'  # default
-    if mime_type:
-        mime_ext_map = {
-            'audio/webm': '.webm',
-            'audio/webm;codecs=opus': '.webm',
-            'audio/ogg': '.ogg',
-            'audio/ogg;codecs=opus': '.ogg',
-            'audio/mp4': '.mp4',
-            'audio/mpeg': '.mp3',
-            'audio/wav': '.wav',
-            'audio/x-wav': '.wav',
-            'audio/flac': '.flac',
-        }
-        ext = mime_ext_map.get(mime_type.lower().strip(), '.webm')
+    ext = AUDIO_MIME_EXT.get(mime_type.strip().lower(), '.webm') if mime_type else '.webm'
     
     # Fallback: detect format from magic bytes if MIME type didn't help
     if len(audio_bytes) >= 4:
-        header = audio_bytes[:4]
-        if header[:4] == b'\x1aE\xdf\xa3':  # WebM/Matroska
-            ext = '.webm'
-        elif header[:4] == b'OggS':  # OGG
-            ext = '.ogg'
-        elif header[:4] == b'fLaC':  # FLAC
-            ext = '.flac'
-        elif header[:4] == b'RIFF':  # WAV
-            ext = '.wav'
-        elif header[:3] == b'ID3' or (header[0:2] == b'\xff\xfb'):  # MP3
+        magic = struct.unpack_from('>I', audio_bytes, 0)[0]
+        if magic in AUDIO_MAGIC_EXT:
+            ext = AUDIO_MAGIC_EXT[magic]
+        elif audio_bytes[:3] == b'ID3' or audio_bytes[:2] == b'\xff\xfb':  # MP3
             ext = '.mp3'
-        elif header[:4] in (b'\x00\x00\x00\x1c', b'\x00\x00\x00\x18', b'\x00\x00\x00\x20'):
-            ext = '.mp4'  # MP4/M4A
 
     logger.info(f"Transcribing audio: {len(audio_bytes)} bytes, mime={mime_type}, ext={ext}")
 
-    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-
-    try:
-        with open(tmp_path, 'rb') as audio_file:
-            kwargs = {
-                "model": "whisper-1",
-                "file": audio_file,
-            }
-            # Provide language hint for better accuracy
-            if language and language != 'en':
-                kwargs["language"] = language
-            transcript = client.audio.transcriptions.create(**kwargs)
-        return transcript.text
-    finally:
-        os.unlink(tmp_path)
+    # Upload straight from memory; the SDK infers the format from the file name
+    audio_file = io.BytesIO(audio_bytes)
+    audio_file.name = f"audio{ext}"
+    kwargs = {
+        "model": "whisper-1",
+        "file": audio_file,
+    }
+    # Provide language hint for better accuracy
+    if language and language != 'en':
+        kwargs["language"] = language
+    transcript = client.audio.transcriptions.create(**kwargs)
+    return transcript.text
 
 
 # TTS voice settings per mode (from config)
@@ -946,20 +1375,72 @@ TTS_EMOTIONAL_MODIFIERS = {
     'encouraging': '\nThe user is facing a challenge. Be warmly encouraging — supportive tone, steady pace, like a mentor who believes in them.',
 }
 
+# Full TTS instructions per (mode, tone), built once instead of concatenated per call
+TTS_INSTRUCTIONS_BY_TONE = {
+    (mode, tone): base + modifier
+    for mode, base in TTS_INSTRUCTIONS.items()
+    for tone, modifier in TTS_EMOTIONAL_MODIFIERS.items()
+}
+
+# Syntheses in progress, keyed by TTS cache key: {key: eventlet Event}.
+# Concurrent requests for the same audio (e.g. opening greetings) wait on the first call.
+_tts_inflight = {}
+
+
+class _TTSSynthesisCancelled(Exception):
+    """Sent to single-flight waiters when the synthesizing greenthread is killed."""
+
+
 def generate_speech(text, voice="coral", mode="interview", emotional_tone="neutral"):
-    """Use OpenAI TTS for natural-sounding speech, with caching and emotional prosody."""
+    """Use OpenAI TTS for natural-sounding speech, with caching and emotional prosody.
+    Returns raw opus bytes, emitted as a Socket.IO binary attachment (no base64)."""
+    key = get_tts_cache_key(text, voice, mode)
+
     # COST: Check cache first
-    cached = get_cached_tts(text, voice, mode)
+    cached = get_cached_tts(text, voice, mode, key=key)
     if cached:
         cache_stats = redis_store.get_tts_cache_stats()
         logger.info(f"TTS cache hit (hits: {cache_stats['hits']}, misses: {cache_stats['misses']})")
-        return base64.b64decode(cached)
+        return cached
 
-    # Build instructions with emotional modifier for prosody injection
-    instructions = TTS_INSTRUCTIONS.get(mode, TTS_INSTRUCTIONS['interview'])
-    emotion_mod = TTS_EMOTIONAL_MODIFIERS.get(emotional_tone, '')
-    if emotion_mod:
-        instructions = instructions + emotion_mod
+    # COST: Single-flight — share an identical synthesis that is already running
+    inflight = _tts_inflight.get(key)
+    if inflight is not None:
+        try:
+            return inflight.wait()
+        except _TTSSynthesisCancelled:
+            pass  # Its response was cancelled mid-synthesis; synthesize here instead
+
+    done = eventlet.event.Event()
+    _tts_inflight[key] = done
+    try:
+        audio_content = _synthesize_speech(text, voice, mode, emotional_tone)
+    except Exception as e:
+        done.send_exception(e)
+        raise
+    except BaseException:
+        # Killed by a cancelled stream (GreenletExit); waiters must not block forever
+        done.send_exception(_TTSSynthesisCancelled())
+        raise
+    finally:
+        _tts_inflight.pop(key, None)
+    done.send(audio_content)
+
+    # Store in cache
+    store_tts_cache(text, voice, mode, audio_content, key=key)
+
+    return audio_content
+
+
+def _synthesize_speech(text, voice, mode, emotional_tone):
+    """Call OpenAI TTS for one utterance and return the opus bytes."""
+
+    # Instructions with emotional modifier for prosody injection
+    instructions = TTS_INSTRUCTIONS_BY_TONE.get((mode, emotional_tone))
+    if instructions is None:
+        # Unknown mode or tone: interview instructions, no modifier
+        instructions = (TTS_INSTRUCTIONS.get(mode, TTS_INSTRUCTIONS['interview'])
+                        + TTS_EMOTIONAL_MODIFIERS.get(emotional_tone, ''))
 
     tts_start = time.time()
     with trace_span('tts_generate', {'voice': voice, 'mode': mode, 'text_length': len(text)}):
@@ -975,10 +1456,6 @@ def generate_speech(text, voice="coral", mode="interview", emotional_tone="neutr
     tts_duration = time.time() - tts_start
     record_tts_duration(voice, mode, tts_duration)
 
-    # Store in cache
-    audio_b64 = base64.b64encode(audio_content).decode('utf-8')
-    store_tts_cache(text, voice, mode, audio_b64)
-
     return audio_content
 
 
@@ -1002,7 +1479,8 @@ def chat_with_gpt(messages, model=None, max_tokens=250):
 
 @trace_function('stream_chat_and_speak')
 def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
-                          voice="coral", mode="interview", emotional_tone="neutral"):
+                          voice="coral", mode="interview", emotional_tone="neutral",
+                          moderation=None):
     """Stream LLM tokens, group into multi-sentence chunks (2-3 sentences),
     generate TTS per chunk for natural prosody, and emit audio progressively.
 
@@ -1010,10 +1488,15 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
     - TTS sounds much more natural when given 2-3 sentences (better prosody, intonation flow)
     - First chunk uses 1 sentence for fast time-to-first-audio
     - Subsequent chunks group 2-3 sentences for natural speech rhythm
+    - TTS runs in greenthreads while the LLM keeps streaming; audio is
+      emitted strictly in chunk order as each synthesis completes
+
+    If a pending moderation greenthread is passed, it is awaited before the
+    first chunk is emitted; a flagged input cancels the stream and returns None.
     """
     model = model or config.OPENAI_CHAT_MODEL
     cancel_token = get_cancellation_token(sid)
-    sentence_enders = '.!?'
+    sentence_enders = frozenset('.!?')
     full_text = ""
     buffer = ""
     chunk_index = 0
@@ -1023,14 +1506,58 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
     first_chunk_sent = False  # First chunk = 1 sentence (fast), rest = 2-3 sentences
     first_sentences = config.STREAMING_FIRST_CHUNK_SENTENCES
     subsequent_sentences = config.STREAMING_SUBSEQUENT_CHUNK_SENTENCES
+    flagged = False
+    pending_audio = []  # (chunk_index, greenthread) in emit order
+
+    def cancel_pending_audio():
+        """Kill TTS greenthreads whose audio will not be sent; unstarted ones never run."""
+        while pending_audio:
+            pending_audio.pop()[1].kill()
+
+    def emit_ready_audio(wait=False):
+        """Emit finished TTS chunks in order; with wait=True, block until all are sent."""
+        nonlocal first_chunk_time
+
+        while pending_audio and (wait or pending_audio[0][1].dead):
+            index, tts_thread = pending_audio.pop(0)
+            try:
+                audio = tts_thread.wait()
+            except Exception as e:
+                logger.error(f"TTS chunk {index} error: {e}")
+                continue
+
+            # Check cancel AFTER TTS (don't send stale audio)
+            if cancel_token['cancelled']:
+                cancel_pending_audio()
+                return
+
+            if not first_chunk_time:
+                first_chunk_time = time.time()
+                latency_ms = int((first_chunk_time - start_time) * 1000)
+                logger.info(f"First audio chunk latency: {latency_ms}ms")
+                record_time_to_first_audio(mode, (first_chunk_time - start_time))
+
+            emit('audio_chunk', {
+                'audio': audio,
+                'chunk_index': index,
+                'done': False
+            })
 
     def flush_tts_chunk(text_chunk):
-        """Generate TTS for a text chunk and emit both text + audio."""
-        nonlocal chunk_index, first_chunk_time, first_chunk_sent
+        """Emit a text chunk and start its TTS without blocking the LLM stream."""
+        nonlocal chunk_index, first_chunk_sent, moderation, flagged
 
         if not text_chunk.strip() or cancel_token['cancelled']:
             return
 
+        # Nothing reaches the client until moderation has cleared the input
+        if moderation is not None:
+            flagged = moderation.wait()[0]
+            moderation = None
+            if flagged:
+                cancel_token['cancelled'] = True
+                return
+
         # Emit text chunk immediately (progressive text display)
         emit('text_chunk', {
             'text': text_chunk,
@@ -1044,34 +1571,11 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
             first_chunk_sent = True
             return
 
-        # Generate TTS for this chunk
-        try:
-            audio_bytes = generate_speech(
-                text_chunk, voice=voice, mode=mode,
-                emotional_tone=emotional_tone
-            )
-
-            # Check cancel AFTER TTS (don't send stale audio)
-            if cancel_token['cancelled']:
-                chunk_index += 1
-                first_chunk_sent = True
-                return
-
-            audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
-
-            if not first_chunk_time:
-                first_chunk_time = time.time()
-                latency_ms = int((first_chunk_time - start_time) * 1000)
-                logger.info(f"First audio chunk latency: {latency_ms}ms")
-                record_time_to_first_audio(mode, (first_chunk_time - start_time))
-
-            emit('audio_chunk', {
-                'audio': audio_b64,
-                'chunk_index': chunk_index,
-                'done': False
-            })
-        except Exception as e:
-            logger.error(f"TTS chunk {chunk_index} error: {e}")
+        # Generate TTS for this chunk in the background; emit_ready_audio sends it
+        pending_audio.append((chunk_index, eventlet.spawn(
+            generate_speech, text_chunk, voice=voice, mode=mode,
+            emotional_tone=emotional_tone
+        )))
 
         chunk_index += 1
         first_chunk_sent = True
@@ -1084,7 +1588,8 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
             messages=messages,
             max_tokens=max_tokens,
             temperature=config.LLM_TEMPERATURE,
-            stream=True
+            stream=True,
+            stream_options={"include_usage": True}
         )
 
         for chunk in response:
@@ -1092,15 +1597,23 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
                 logger.info(f"Generation cancelled mid-stream for {sid[:8]}")
                 break
 
+            emit_ready_audio()
+
+            # The final chunk carries token usage and no choices
+            if chunk.usage is not None:
+                record_tokens(model, 'total', chunk.usage.total_tokens)
+            if not chunk.choices:
+                continue
+
             delta = chunk.choices[0].delta
             if delta.content:
                 token = delta.content
                 full_text += token
                 buffer += token
 
-                # Check for sentence boundary
-                stripped = buffer.rstrip()
-                if stripped and stripped[-1] in sentence_enders and len(stripped) > 10:
+                # Check for sentence boundary; only a token ending in punctuation can close
+                # one, so the growing buffer is not re-stripped for every token
+                if token.rstrip()[-1:] in sentence_enders and len(buffer.rstrip()) > 10:
                     sentence_count_in_buffer += 1
 
                     # FIRST chunk: send after 1 sentence for fast time-to-first-audio
@@ -1115,7 +1628,7 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
                         flush_tts_chunk(buffer.strip())
                         buffer = ""
                         sentence_count_in_buffer = 0
-                        # Yield again after TTS to process any cancel during TTS
+                        # Yield again so TTS can start and any cancel can be processed
                         eventlet.sleep(0)
 
                         if cancel_token['cancelled']:
@@ -1125,6 +1638,12 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
         if buffer.strip() and not cancel_token['cancelled']:
             flush_tts_chunk(buffer.strip())
 
+        if not cancel_token['cancelled']:
+            emit_ready_audio(wait=True)
+
+        if flagged or (moderation is not None and moderation.wait()[0]):
+            return None
+
         # Signal stream completion
         if not cancel_token['cancelled']:
             total_time = int((time.time() - start_time) * 1000)
@@ -1141,28 +1660,35 @@ def stream_chat_and_speak(sid, messages, model=None, max_tokens=300,
         logger.error(f"Streaming pipeline error: {e}", exc_info=True)
         raise
     finally:
-        active_generations.pop(sid, None)
+        # Cancelled, flagged or failed: stop paying for audio nobody will hear
+        cancel_pending_audio()
+        release_cancellation_token(sid, cancel_token)
 
 
 @trace_function('process_and_respond')
-def process_and_respond(sid, user_text):
+def process_and_respond(sid, user_text, conv=None):
     """Process user input, get GPT response, convert to speech, and emit.
     Uses streaming LLM + chunked TTS pipeline when voice mode is ON for
-    natural-sounding, low-latency conversational audio."""
-    conv = get_conversation(sid)
+    natural-sounding, low-latency conversational audio.
+    Handlers pass the conv they already loaded to avoid a second store round-trip."""
+    if conv is None:
+        conv = get_conversation(sid)
 
     # CONCURRENCY GUARD: Only one response at a time per session
-    # If already processing, cancel the old one first
+    # If already processing, cancel the old one first (the newest message wins)
     if processing_lock.get(sid):
         cancel_generation(sid)
         # Give event loop a moment to process the cancel
         eventlet.sleep(0)  # yield to event loop
-    processing_lock[sid] = True
+    owner = object()
+    processing_lock[sid] = owner
 
     try:
         return _process_and_respond_inner(sid, user_text, conv)
     finally:
-        processing_lock.pop(sid, None)
+        # A cancelled response must not release the lock its replacement now holds
+        if processing_lock.get(sid) is owner:
+            processing_lock.pop(sid, None)
 
 
 def _process_and_respond_inner(sid, user_text, conv):
@@ -1184,10 +1710,12 @@ def _process_and_respond_inner(sid, user_text, conv):
         emit('status', {'message': 'Let\'s keep the conversation on track!'})
         return
 
-    # NOTE: Content moderation via OpenAI API removed from the hot path.
-    # It added 200-500ms latency to every message which killed conversational pace.
-    # For production, run moderation asynchronously or via Celery task.
+    # SECURITY: Content moderation runs in a greenthread alongside the LLM call,
+    # so it costs max(moderation, LLM) instead of moderation + LLM per turn.
+    # The reply is only released once moderation has cleared the input.
+    moderation = eventlet.spawn(moderate_content, user_text) if config.MODERATION_ENABLED else None
 
+    user_index = len(conv['messages'])
     conv['messages'].append({"role": "user", "content": user_text})
     conv['exchange_count'] = conv.get('exchange_count', 0) + 1
 
@@ -1226,13 +1754,24 @@ def _process_and_respond_inner(sid, user_text, conv):
         if conv.get('voice_mode', False):
             # Voice mode: Streaming pipeline (blueprint: streaming LLM → streaming TTS)
             bot_text = stream_chat_and_speak(
-                sid, conv['messages'], model=model, max_tokens=max_tokens,
-                voice=voice, mode=mode, emotional_tone=emotional_tone
+                sid, build_llm_messages(conv), model=model, max_tokens=max_tokens,
+                voice=voice, mode=mode, emotional_tone=emotional_tone,
+                moderation=moderation
             )
         else:
             # Text mode: Non-streaming, send text only (cost-efficient)
-            bot_text = chat_with_gpt(conv['messages'], model=model, max_tokens=max_tokens)
-            emit('text_response', {'text': bot_text, 'msg_id': conv['exchange_count']})
+            bot_text = chat_with_gpt(build_llm_messages(conv), model=model, max_tokens=max_tokens)
+            if moderation is None or not moderation.wait()[0]:
+                emit('text_response', {'text': bot_text, 'msg_id': conv['exchange_count']})
+            else:
+                bot_text = None
+
+        if moderation is not None and bot_text is None and moderation.wait()[0]:
+            logger.warning(f"Flagged content from session {sid[:8]}...")
+            # Drop the flagged turn (and any hint injected for it) from history
+            del conv['messages'][user_index:]
+            emit('status', {'message': 'Let\'s keep the conversation respectful and on track!'})
+            return
 
         if bot_text:
             conv['messages'].append({"role": "assistant", "content": bot_text})
@@ -1243,27 +1782,13 @@ def _process_and_respond_inner(sid, user_text, conv):
 
             # Persist to database
             if conv.get('conversation_id'):
-                db_module.log_message(
+                log_message_async(
                     conv['conversation_id'], conv['exchange_count'],
                     'assistant', bot_text, emotional_tone=conv['emotional_tone']
                 )
 
-        # Smart history management: LLM-compressed summarization (blueprint: context window pruning)
-        compression_threshold = config.MEMORY_COMPRESSION_THRESHOLD
-        if len(conv['messages']) > compression_threshold:
-            system_msg = conv['messages'][0]
-            old_messages = conv['messages'][1:-(compression_threshold - 1)]
-            recent_messages = conv['messages'][-(compression_threshold - 1):]
-
-            summary = summarize_old_messages(old_messages)
-            if summary:
-                system_with_context = {
-                    "role": "system",
-                    "content": system_msg['content'] + "\n\n" + summary
-                }
-                conv['messages'] = [system_with_context] + recent_messages
-            else:
-                conv['messages'] = [system_msg] + recent_messages
+        # Smart history management: rolling summary of evicted turns (blueprint: context window pruning)
+        compress_history(conv)
 
         # Save conversation state to Redis
         save_conversation(sid, conv)
@@ -1429,57 +1954,86 @@ def index():
 # FILE UPLOAD: Extract text from CV / Job Profile documents
 # Supports PDF, DOCX, DOC, TXT — extracts plain text for prompt context
 # ============================================================
-ALLOWED_UPLOAD_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt'}
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({'pdf', 'doc', 'docx', 'txt'})
 MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_UPLOAD_EXTENSIONS
-
-def extract_text_from_file(file_storage):
-    """Extract plain text from uploaded file (PDF, DOCX, TXT)."""
-    filename = secure_filename(file_storage.filename)
-    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-
+MAX_UPLOAD_REQUEST_SIZE = MAX_UPLOAD_SIZE + 64 * 1024  # Room for multipart boundaries, part headers and form fields
+MAX_UPLOAD_TEXT_CHARS = 4000  # Extracted text kept for prompt context
+MAX_UPLOAD_PDF_PAGES = 20  # Page cap for the pdfminer fallback, which cannot stop early
+# PDFium is not thread-safe, even across separate documents, and extraction runs on
+# eventlet's OS thread pool. The gunicorn eventlet worker monkey-patches threading,
+# so take the lock from the unpatched module: it must block real threads.
+_PDFIUM_LOCK = eventlet.patcher.original('threading').Lock()
+
+def _join_page_texts(page_texts, separator):
+    """Join page texts lazily, stopping once there is more than the prompt will keep.
+    page_texts is a generator, so pages past that point are never parsed."""
+    parts = []
+    total = 0
+    for page_text in page_texts:
+        parts.append(page_text)
+        total += len(page_text) + len(separator)
+        if total > MAX_UPLOAD_TEXT_CHARS:
+            break
+    return separator.join(parts).strip()
+
+
+def _extract_raw_text(data, ext):
+    """Extract plain text from uploaded file bytes (PDF, DOCX, TXT); ext is lowercase, without the dot."""
     if ext == 'txt':
-        return file_storage.read().decode('utf-8', errors='ignore')
+        return data.decode('utf-8', errors='ignore')
 
     elif ext == 'pdf':
+        try:
+            import pypdfium2 as pdfium  # Optional: PDFium (C) text extraction, much faster than PyPDF2
+            with _PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(data)
+                try:
+                    return _join_page_texts((page.get_textpage().get_text_range() for page in pdf), '\n')
+                finally:
+                    pdf.close()
+        except ImportError:
+            pass
         try:
             import PyPDF2
-            reader = PyPDF2.PdfReader(file_storage)
-            text = ''
-            for page in reader.pages:
-                text += page.extract_text() or ''
-            return text.strip()
+            reader = PyPDF2.PdfReader(io.BytesIO(data))
+            return _join_page_texts((page.extract_text() or '' for page in reader.pages), '')
         except ImportError:
             # Fallback: try pdfminer
             try:
                 from pdfminer.high_level import extract_text as pdf_extract
-                file_storage.seek(0)
-                return pdf_extract(file_storage).strip()
+                return pdf_extract(io.BytesIO(data), maxpages=MAX_UPLOAD_PDF_PAGES).strip()
             except ImportError:
-                return file_storage.read().decode('utf-8', errors='ignore')
+                return data.decode('utf-8', errors='ignore')
 
     elif ext in ('doc', 'docx'):
         try:
             import docx
-            file_storage.seek(0)
-            with tempfile.NamedTemporaryFile(suffix=f'.{ext}', delete=False) as tmp:
-                tmp.write(file_storage.read())
-                tmp_path = tmp.name
-            doc = docx.Document(tmp_path)
-            text = '\n'.join(para.text for para in doc.paragraphs)
-            os.unlink(tmp_path)
-            return text.strip()
+            # python-docx reads the zip from any seekable stream; no temp file needed
+            doc = docx.Document(io.BytesIO(data))
+            return _join_page_texts((para.text for para in doc.paragraphs), '\n')
         except ImportError:
-            return file_storage.read().decode('utf-8', errors='ignore')
+            return data.decode('utf-8', errors='ignore')
 
-    return file_storage.read().decode('utf-8', errors='ignore')
+    return data.decode('utf-8', errors='ignore')
+
+
+def extract_text_from_file(data, ext):
+    """Extract plain text from uploaded file bytes, truncated to MAX_UPLOAD_TEXT_CHARS."""
+    text = _extract_raw_text(data, ext)
+    if len(text) > MAX_UPLOAD_TEXT_CHARS:
+        text = text[:MAX_UPLOAD_TEXT_CHARS] + '...[truncated]'
+    return text
 
 
 @app.route('/api/upload-document', methods=['POST'])
 def upload_document():
     """Upload a CV or Job Profile document, extract text, return it."""
+    # Reject on the Content-Length header before the multipart body is parsed. It counts
+    # the whole form, so only bodies that can't hold a file within the limit are refused;
+    # the exact file-size check follows the read below
+    if request.content_length and request.content_length > MAX_UPLOAD_REQUEST_SIZE:
+        return jsonify({'error': 'File too large (max 5MB)'}), 413
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
 
@@ -1489,25 +2043,23 @@ def upload_document():
     if not file.filename:
         return jsonify({'error': 'No file selected'}), 400
 
-    if not allowed_file(file.filename):
+    ext = os.path.splitext(file.filename)[1].lower().lstrip('.')
+    if ext not in ALLOWED_UPLOAD_EXTENSIONS:
         return jsonify({'error': 'Unsupported file type. Use PDF, DOCX, DOC, or TXT'}), 400
 
-    # Check file size
-    file.seek(0, os.SEEK_END)
-    size = file.tell()
-    file.seek(0)
-    if size > MAX_UPLOAD_SIZE:
-        return jsonify({'error': 'File too large (max 5MB)'}), 400
+    # Read the upload once; every parser works from this buffer.
+    # Length is re-checked for chunked requests that sent no Content-Length.
+    data = file.read(MAX_UPLOAD_SIZE + 1)
+    if len(data) > MAX_UPLOAD_SIZE:
+        return jsonify({'error': 'File too large (max 5MB)'}), 413
 
     try:
-        text = extract_text_from_file(file)
+        # Parsing is CPU-bound C code that never yields; run it on a native thread
+        # so other sockets on this eventlet worker keep being served meanwhile
+        text = eventlet.tpool.execute(extract_text_from_file, data, ext)
         if not text or len(text.strip()) < 10:
             return jsonify({'error': 'Could not extract text from file'}), 400
 
-        # Truncate to reasonable size (max 4000 chars for prompt context)
-        if len(text) > 4000:
-            text = text[:4000] + '...[truncated]'
-
         logger.info(f"Document uploaded: type={doc_type}, filename={file.filename}, chars={len(text)}")
         return jsonify({'text': text, 'type': doc_type, 'chars': len(text)})
 
@@ -1521,6 +2073,36 @@ def upload_document():
 # Browser gets ephemeral token → connects DIRECTLY to OpenAI WebRTC
 # This is the recommended approach per OpenAI's reference implementation
 # ============================================================
+def realtime_session_config(instructions, voice):
+    """Realtime session body shared by the token and unified-call endpoints.
+    Only the instructions and voice vary per request."""
+    return {
+        "session": {
+            "type": "realtime",
+            "model": config.OPENAI_REALTIME_MODEL,
+            "instructions": instructions,
+            "output_modalities": ["audio"],
+            "audio": {
+                "input": {
+                    "turn_detection": {
+                        "type": "semantic_vad",
+                        "eagerness": "auto",
+                        "create_response": True,
+                        "interrupt_response": True,
+                    },
+                    "transcription": {
+                        "model": "whisper-1",
+                        "language": "en",
+                    },
+                },
+                "output": {
+                    "voice": voice,
+                }
+            },
+        }
+    }
+
+
 @app.route('/api/realtime/token', methods=['GET', 'POST'])
 def create_realtime_token():
     """Mint an ephemeral API key for direct browser→OpenAI WebRTC connection.
@@ -1550,10 +2132,9 @@ def create_realtime_token():
     if mode == 'interview':
         # Use persona-specific prompt if persona info is provided
         if persona_name and persona_greeting:
-            instructions = REALTIME_INTERVIEW_PROMPT_TEMPLATE.format(
-                persona_name=persona_name,
-                persona_title=persona_title or 'a senior interviewer',
-                persona_greeting=persona_greeting
+            instructions = realtime_persona_prompt(
+                'interview', persona_name,
+                persona_title or 'a senior interviewer', persona_greeting
             )
         else:
             instructions = REALTIME_INTERVIEW_PROMPT
@@ -1572,17 +2153,15 @@ def create_realtime_token():
     elif mode == 'helpdesk':
         # Use persona-specific prompt if persona info is provided
         if persona_name and persona_greeting:
-            instructions = REALTIME_HELPDESK_PROMPT_TEMPLATE.format(
-                persona_name=persona_name,
-                persona_title=persona_title or 'a friendly IT Helpdesk agent',
-                persona_greeting=persona_greeting
+            instructions = realtime_persona_prompt(
+                'helpdesk', persona_name,
+                persona_title or 'a friendly IT Helpdesk agent', persona_greeting
             )
         else:
             instructions = REALTIME_HELPDESK_PROMPT
         voice = TTS_VOICES.get('helpdesk', 'cedar')
     elif mode == 'language':
-        language_name = SUPPORTED_LANGUAGES.get(language, 'English')
-        instructions = REALTIME_LANGUAGE_PROMPT.format(language=language_name)
+        instructions = REALTIME_LANGUAGE_PROMPTS.get(language, REALTIME_LANGUAGE_PROMPTS['en'])
         voice = TTS_VOICES.get('language', 'cedar')
     else:
         instructions = REALTIME_INTERVIEW_PROMPT
@@ -1590,34 +2169,10 @@ def create_realtime_token():
 
     # Build session config — matches OpenAI's reference implementation format
     # Config is baked into the ephemeral token so the browser doesn't need it
-    session_config = {
-        "session": {
-            "type": "realtime",
-            "model": config.OPENAI_REALTIME_MODEL,
-            "instructions": instructions,
-            "output_modalities": ["audio"],
-            "audio": {
-                "input": {
-                    "turn_detection": {
-                        "type": "semantic_vad",
-                        "eagerness": "auto",
-                        "create_response": True,
-                        "interrupt_response": True,
-                    },
-                    "transcription": {
-                        "model": "whisper-1",
-                        "language": "en",
-                    },
-                },
-                "output": {
-                    "voice": voice,
-                }
-            },
-        }
-    }
+    session_config = realtime_session_config(instructions, voice)
 
     try:
-        response = http_requests.post(
+        response = openai_http.post(
             "https://api.openai.com/v1/realtime/client_secrets",
             headers={
                 "Authorization": f"Bearer {config.OPENAI_API_KEY}",
@@ -1632,7 +2187,7 @@ def create_realtime_token():
         logger.info(f"Realtime token created: mode={mode}, voice={voice}")
         return jsonify(data)
 
-    except http_requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"Realtime token API error: {e.response.status_code} {e.response.text}")
         return jsonify({"error": "Failed to create voice session", "details": e.response.text}), 502
     except Exception as e:
@@ -1671,88 +2226,29 @@ def create_realtime_session():
         instructions = REALTIME_HELPDESK_PROMPT
         voice = TTS_VOICES.get('helpdesk', 'cedar')
     elif mode == 'language':
-        language_name = SUPPORTED_LANGUAGES.get(language, 'English')
-        instructions = REALTIME_LANGUAGE_PROMPT.format(language=language_name)
+        instructions = REALTIME_LANGUAGE_PROMPTS.get(language, REALTIME_LANGUAGE_PROMPTS['en'])
         voice = TTS_VOICES.get('language', 'cedar')
     else:
         instructions = REALTIME_INTERVIEW_PROMPT
         voice = 'marin'
 
     # Build session config with session wrapper (matching reference implementation)
-    session_config = json_module.dumps({
-        "session": {
-            "type": "realtime",
-            "model": config.OPENAI_REALTIME_MODEL,
-            "instructions": instructions,
-            "output_modalities": ["audio"],
-            "audio": {
-                "input": {
-                    "turn_detection": {
-                        "type": "semantic_vad",
-                        "eagerness": "auto",
-                        "create_response": True,
-                        "interrupt_response": True,
-                    },
-                    "transcription": {
-                        "model": "whisper-1",
-                        "language": "en",
-                    },
-                },
-                "output": {
-                    "voice": voice,
-                }
-            },
-        }
-    })
+    session_config = json_module.dumps(realtime_session_config(instructions, voice))
 
     try:
         # Unified interface: send SDP + config as multipart form to /v1/realtime/calls
-        from requests_toolbelt import MultipartEncoder
-
-        # Try with requests_toolbelt, fall back to manual multipart
-        try:
-            m = MultipartEncoder(
-                fields={
-                    'sdp': ('sdp', sdp_offer, 'application/sdp'),
-                    'session': ('session', session_config, 'application/json'),
-                }
-            )
-            response = http_requests.post(
-                "https://api.openai.com/v1/realtime/calls",
-                headers={
-                    "Authorization": f"Bearer {config.OPENAI_API_KEY}",
-                    "OpenAI-Beta": "realtime=v1",
-                    "Content-Type": m.content_type,
-                },
-                data=m,
-                timeout=15,
-            )
-        except ImportError:
-            # Fallback: manual multipart form
-            import uuid
-            boundary = uuid.uuid4().hex
-            body = (
-                f'--{boundary}\r\n'
-                f'Content-Disposition: form-data; name="sdp"\r\n'
-                f'Content-Type: application/sdp\r\n\r\n'
-                f'{sdp_offer}\r\n'
-                f'--{boundary}\r\n'
-                f'Content-Disposition: form-data; name="session"\r\n'
-                f'Content-Type: application/json\r\n\r\n'
-                f'{session_config}\r\n'
-                f'--{boundary}--\r\n'
-            )
-            response = http_requests.post(
-                "https://api.openai.com/v1/realtime/calls",
-                headers={
-                    "Authorization": f"Bearer {config.OPENAI_API_KEY}",
-                    "OpenAI-Beta": "realtime=v1",
-                    "Content-Type": f"multipart/form-data; boundary={boundary}",
-                },
-                data=body.encode('utf-8'),
-                timeout=15,
-            )
-
+        response = openai_http.post(
+            "https://api.openai.com/v1/realtime/calls",
+            headers={
+                "Authorization": f"Bearer {config.OPENAI_API_KEY}",
+                "OpenAI-Beta": "realtime=v1",
+            },
+            files={
+                'sdp': (None, sdp_offer, 'application/sdp'),
+                'session': (None, session_config, 'application/json'),
+            },
+            timeout=15,
+        )
         response.raise_for_status()
         answer_sdp = response.text
 
@@ -1760,7 +2256,7 @@ def create_realtime_session():
         # Return SDP answer directly as text
         return Response(answer_sdp, content_type='application/sdp')
 
-    except http_requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"Realtime API error: {e.response.status_code} {e.response.text}")
         return jsonify({"error": "Failed to create voice session", "details": e.response.text}), 502
     except Exception as e:
@@ -1771,13 +2267,19 @@ def create_realtime_session():
 # ============================================================
 # SECURITY: HTTPS redirect in production
 # ============================================================
-@app.before_request
+IS_RENDER = bool(os.getenv('RENDER'))  # Render.com sets RENDER; resolved once at import
+
+
 def enforce_https():
     """Redirect HTTP to HTTPS in production (Render sets x-forwarded-proto)."""
-    if os.getenv('RENDER'):  # Only on Render.com
-        if request.headers.get('X-Forwarded-Proto', 'http') != 'https':
-            url = request.url.replace('http://', 'https://', 1)
-            return redirect(url, code=301)
+    if request.headers.get('X-Forwarded-Proto', 'http') != 'https':
+        url = request.url.replace('http://', 'https://', 1)
+        return redirect(url, code=301)
+
+
+# Only on Render.com — elsewhere the hook isn't registered at all
+if IS_RENDER:
+    app.before_request(enforce_https)
 
 
 # Security headers now handled by middleware module
@@ -1786,9 +2288,19 @@ def enforce_https():
 # ============================================================
 # ROUTES: Health check, Privacy Policy, Terms of Service
 # ============================================================
+_health_cache = (0.0, None, 200)  # (expires_at, payload, status_code)
+
+
 @app.route('/health')
 def health_check():
-    """Enterprise health check with dependency status."""
+    """Enterprise health check with dependency status.
+    The report is reused for HEALTH_CACHE_TTL seconds so platform and load-balancer
+    probes don't query Redis, the database and Celery on every ping."""
+    global _health_cache
+    expires_at, cached, cached_status = _health_cache
+    if cached is not None and time.time() < expires_at:
+        return jsonify(cached), cached_status
+
     session_count = redis_store.get_session_count()
     set_active_sessions(session_count)
 
@@ -1817,6 +2329,7 @@ def health_check():
 
     health['status'] = 'healthy' if overall_healthy else 'degraded'
     status_code = 200 if overall_healthy else 503
+    _health_cache = (time.time() + config.HEALTH_CACHE_TTL, health, status_code)
     return jsonify(health), status_code
 
 
@@ -1890,11 +2403,21 @@ def terms_of_service():
     return render_template('terms.html')
 
 
+# Service worker body and strong ETag, read once at startup (deploys restart the process)
+with open(os.path.join(app.static_folder or 'static', 'sw.js'), 'rb') as _sw_file:
+    SW_BODY = _sw_file.read()
+SW_ETAG = hashlib.blake2b(SW_BODY, digest_size=16).hexdigest()
+
+
 @app.route('/sw.js')
 def service_worker():
-    """Serve service worker from root scope for PWA."""
-    return send_from_directory(app.static_folder or 'static', 'sw.js',
-                               mimetype='application/javascript')
+    """Serve service worker from root scope for PWA.
+    Served from memory; browsers revalidate with If-None-Match and get a 304 when unchanged.
+    no-cache (not max-age) so a new deploy's worker is picked up on the next load."""
+    response = Response(SW_BODY, mimetype='application/javascript')
+    response.set_etag(SW_ETAG)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 
 @socketio.on('connect')
@@ -1927,6 +2450,7 @@ def handle_connect():
         'session_start': time.time(),
         'emotional_tone': 'neutral',
         'last_assistant_partial': '',
+        'summary': '',
         'conversation_id': None,
         'user_id': user_payload.get('sub') if user_payload else None,
     }
@@ -1966,51 +2490,71 @@ def handle_disconnect():
     set_active_sessions(redis_store.get_session_count())
 
 
-@socketio.on('start_interview')
-def handle_start_interview(data=None):
-    sid = get_session_id()
-    conv = get_conversation(sid)
-    conv['mode'] = 'interview'
+# Opening-turn token budget per mode
+MODE_MAX_TOKENS = {
+    'interview': config.LLM_MAX_TOKENS_INTERVIEW,
+    'language': config.LLM_MAX_TOKENS_LANGUAGE,
+    'helpdesk': config.LLM_MAX_TOKENS_HELPDESK,
+}
 
-    # Build system prompt with optional CV/Job context
-    system_prompt = INTERVIEW_SYSTEM_PROMPT
-    if data:
-        cv_text = data.get('cv_text', '')
-        job_profile_text = data.get('job_profile_text', '')
-        if cv_text and cv_text.strip():
-            system_prompt += f"\n\n# Candidate's CV/Resume\nUse this to tailor your questions:\n---\n{cv_text.strip()[:3000]}\n---"
-        if job_profile_text and job_profile_text.strip():
-            system_prompt += f"\n\n# Job Profile\nTailor questions to assess fit for this role:\n---\n{job_profile_text.strip()[:3000]}\n---"
 
-    conv['messages'] = [{"role": "system", "content": system_prompt}]
+def _start_mode(sid, conv, mode, system_message, label, event, language='en'):
+    """Shared start_* flow: reset history to the system message, log the session,
+    then generate and emit the assistant's opening turn."""
+    conv['mode'] = mode
+    conv['messages'] = [system_message]
+    conv['summary'] = ''
 
     # Log conversation start to database
-    conv['conversation_id'] = db_module.log_conversation_start(sid, 'interview', user_id=conv.get('user_id') or '')
-    db_module.log_analytics_event('session_start', {'mode': 'interview'}, session_id=sid)
+    conv['conversation_id'] = db_module.log_conversation_start(sid, mode, language=language, user_id=conv.get('user_id') or '')
+    analytics = {'mode': mode, 'language': language} if mode == 'language' else {'mode': mode}
+    db_module.log_analytics_event('session_start', analytics, session_id=sid)
 
     try:
-        logger.info("Starting interview — getting first question")
+        logger.info(f"Starting {label}")
 
         if conv.get('voice_mode', False):
             bot_text = stream_chat_and_speak(
                 sid, conv['messages'], model=config.OPENAI_CHAT_MODEL,
-                max_tokens=config.LLM_MAX_TOKENS_INTERVIEW,
-                voice=TTS_VOICES['interview'], mode='interview', emotional_tone='neutral'
+                max_tokens=MODE_MAX_TOKENS[mode],
+                voice=TTS_VOICES[mode], mode=mode, emotional_tone='neutral'
             )
             if bot_text:
                 conv['messages'].append({"role": "assistant", "content": bot_text or ''})
         else:
             bot_text = chat_with_gpt(conv['messages'], model=config.OPENAI_CHAT_MODEL,
-                                     max_tokens=config.LLM_MAX_TOKENS_INTERVIEW)
+                                     max_tokens=MODE_MAX_TOKENS[mode])
             conv['messages'].append({"role": "assistant", "content": bot_text or ''})
             emit('text_response', {'text': bot_text, 'msg_id': 0})
 
         save_conversation(sid, conv)
-        logger.info(f"Interview started: {(bot_text or '')[:80]}...")
+        logger.info(f"{label} started: {(bot_text or '')[:80]}...")
     except Exception as e:
-        logger.error(f"start_interview error: {e}", exc_info=True)
-        record_error('start_interview', type(e).__name__)
-        emit('status', {'message': 'Error starting interview. Please try again.'})
+        logger.error(f"{event} error: {e}", exc_info=True)
+        record_error(event, type(e).__name__)
+        emit('status', {'message': f'Error starting {label}. Please try again.'})
+
+
+@socketio.on('start_interview')
+def handle_start_interview(data=None):
+    sid = get_session_id()
+    conv = get_conversation(sid)
+
+    # Build system prompt with optional CV/Job context
+    system_prompt = INTERVIEW_SYSTEM_PROMPT
+    if data:
+        cv_text = data.get('cv_text', '')
+        job_profile_text = data.get('job_profile_text', '')
+        if cv_text and cv_text.strip():
+            system_prompt += f"\n\n# Candidate's CV/Resume\nUse this to tailor your questions:\n---\n{cv_text.strip()[:3000]}\n---"
+        if job_profile_text and job_profile_text.strip():
+            system_prompt += f"\n\n# Job Profile\nTailor questions to assess fit for this role:\n---\n{job_profile_text.strip()[:3000]}\n---"
+    if system_prompt == INTERVIEW_SYSTEM_PROMPT:
+        system_message = INTERVIEW_SYSTEM_MESSAGE
+    else:
+        system_message = {"role": "system", "content": system_prompt}
+
+    _start_mode(sid, conv, 'interview', system_message, 'interview', 'start_interview')
 
 
 @socketio.on('start_language_test')
@@ -2023,78 +2567,18 @@ def handle_start_language_test(data):
         emit('status', {'message': 'Unsupported language selected.'})
         return
 
-    language_name = SUPPORTED_LANGUAGES[language_code]
-
     conv = get_conversation(sid)
-    conv['mode'] = 'language'
     conv['language'] = language_code
-    conv['messages'] = [
-        {"role": "system", "content": LANGUAGE_SYSTEM_PROMPT.format(language=language_name)}
-    ]
-
-    # Log conversation start to database
-    conv['conversation_id'] = db_module.log_conversation_start(sid, 'language', language=language_code, user_id=conv.get('user_id') or '')
-    db_module.log_analytics_event('session_start', {'mode': 'language', 'language': language_code}, session_id=sid)
-
-    try:
-        logger.info(f"Starting language test: {language_name}")
-
-        if conv.get('voice_mode', False):
-            bot_text = stream_chat_and_speak(
-                sid, conv['messages'], model=config.OPENAI_CHAT_MODEL,
-                max_tokens=config.LLM_MAX_TOKENS_LANGUAGE,
-                voice=TTS_VOICES['language'], mode='language', emotional_tone='neutral'
-            )
-            if bot_text:
-                conv['messages'].append({"role": "assistant", "content": bot_text or ''})
-        else:
-            bot_text = chat_with_gpt(conv['messages'], model=config.OPENAI_CHAT_MODEL,
-                                     max_tokens=config.LLM_MAX_TOKENS_LANGUAGE)
-            conv['messages'].append({"role": "assistant", "content": bot_text or ''})
-            emit('text_response', {'text': bot_text, 'msg_id': 0})
-
-        save_conversation(sid, conv)
-        logger.info(f"Language test started: {(bot_text or '')[:80]}...")
-    except Exception as e:
-        logger.error(f"start_language_test error: {e}", exc_info=True)
-        record_error('start_language_test', type(e).__name__)
-        emit('status', {'message': 'Error starting language test. Please try again.'})
+    _start_mode(sid, conv, 'language', LANGUAGE_SYSTEM_MESSAGES[language_code],
+                'language test', 'start_language_test',
+                language=language_code)
 
 
 @socketio.on('start_helpdesk')
 def handle_start_helpdesk():
     sid = get_session_id()
     conv = get_conversation(sid)
-    conv['mode'] = 'helpdesk'
-    conv['messages'] = [{"role": "system", "content": IT_HELPDESK_SYSTEM_PROMPT}]
-
-    # Log conversation start to database
-    conv['conversation_id'] = db_module.log_conversation_start(sid, 'helpdesk', user_id=conv.get('user_id') or '')
-    db_module.log_analytics_event('session_start', {'mode': 'helpdesk'}, session_id=sid)
-
-    try:
-        logger.info("Starting IT Helpdesk session")
-
-        if conv.get('voice_mode', False):
-            bot_text = stream_chat_and_speak(
-                sid, conv['messages'], model=config.OPENAI_CHAT_MODEL,
-                max_tokens=config.LLM_MAX_TOKENS_HELPDESK,
-                voice=TTS_VOICES['helpdesk'], mode='helpdesk', emotional_tone='neutral'
-            )
-            if bot_text:
-                conv['messages'].append({"role": "assistant", "content": bot_text or ''})
-        else:
-            bot_text = chat_with_gpt(conv['messages'], model=config.OPENAI_CHAT_MODEL,
-                                     max_tokens=config.LLM_MAX_TOKENS_HELPDESK)
-            conv['messages'].append({"role": "assistant", "content": bot_text or ''})
-            emit('text_response', {'text': bot_text, 'msg_id': 0})
-
-        save_conversation(sid, conv)
-        logger.info(f"Helpdesk started: {(bot_text or '')[:80]}...")
-    except Exception as e:
-        logger.error(f"start_helpdesk error: {e}", exc_info=True)
-        record_error('start_helpdesk', type(e).__name__)
-        emit('status', {'message': 'Error starting IT Helpdesk. Please try again.'})
+    _start_mode(sid, conv, 'helpdesk', IT_HELPDESK_SYSTEM_MESSAGE, 'IT Helpdesk', 'start_helpdesk')
 
 
 @socketio.on('audio_message')
@@ -2113,35 +2597,38 @@ def handle_audio_message(data):
         requested_mode = data.get('mode', 'interview') if isinstance(data, dict) else 'interview'
         if requested_mode == 'helpdesk':
             conv['mode'] = 'helpdesk'
-            conv['messages'] = [{"role": "system", "content": IT_HELPDESK_SYSTEM_PROMPT}]
+            conv['messages'] = [IT_HELPDESK_SYSTEM_MESSAGE]
         elif requested_mode == 'language':
             conv['mode'] = 'language'
-            language_code = conv.get('language', 'en')
-            language_name = SUPPORTED_LANGUAGES.get(language_code, 'English')
-            conv['messages'] = [{"role": "system", "content": LANGUAGE_SYSTEM_PROMPT.format(language=language_name)}]
+            conv['messages'] = [LANGUAGE_SYSTEM_MESSAGES.get(conv.get('language', 'en'), LANGUAGE_SYSTEM_MESSAGES['en'])]
         else:
             conv['mode'] = 'interview'
-            conv['messages'] = [{"role": "system", "content": INTERVIEW_SYSTEM_PROMPT}]
+            conv['messages'] = [INTERVIEW_SYSTEM_MESSAGE]
+        save_conversation(sid, conv)
         logger.info(f"Auto-initialized mode to {conv['mode']} for {sid[:8]}")
 
     try:
-        # SECURITY: Validate audio data exists and is a string
-        if 'audio' not in data or not isinstance(data['audio'], str):
+        # SECURITY: Validate audio data exists (binary attachment, or legacy base64 string)
+        audio = data.get('audio')
+        if not isinstance(audio, (bytes, str)):
             emit('status', {'message': 'Invalid audio data.'})
             return
 
-        # Decode base64 audio
-        try:
-            audio_bytes = base64.b64decode(data['audio'])
-        except Exception:
-            emit('status', {'message': 'Invalid audio format.'})
-            return
-
-        # SECURITY: Check audio size
-        if len(audio_bytes) > MAX_AUDIO_SIZE:
+        # SECURITY: Check audio size before decoding anything
+        if len(audio) > (MAX_AUDIO_SIZE if isinstance(audio, bytes) else MAX_AUDIO_B64_SIZE):
             emit('status', {'message': 'Audio too long. Please keep messages shorter.'})
             return
 
+        if isinstance(audio, bytes):
+            audio_bytes = audio
+        else:
+            # Decode base64 audio; validate=True rejects non-alphabet input up front
+            try:
+                audio_bytes = base64.b64decode(audio, validate=True)
+            except Exception:
+                emit('status', {'message': 'Invalid audio format.'})
+                return
+
         # Skip very small audio clips (likely noise or empty recordings)
         if len(audio_bytes) < 2000:
             logger.info(f"Audio too small ({len(audio_bytes)} bytes), skipping")
@@ -2179,17 +2666,8 @@ def handle_audio_message(data):
         emit('user_transcription', {'text': user_text})
 
         # Filter out Whisper hallucinations on silence/noise
-        # ONLY filter phrases that Whisper commonly hallucinates on silent audio
-        # Do NOT filter real conversational words like 'wait', 'thanks', 'bye', etc.
-        whisper_noise = [
-            'thanks for watching', 'thank you for watching', 'subtitles by',
-            'the end', 'silence', 'applause', 'foreign', 'laughter', 'cheering',
-            'inaudible', 'unintelligible', 'no audio', 'blank audio',
-            'subscribe', 'like and subscribe', 'bell icon',
-            'please subscribe', 'click the bell', 'music',
-        ]
-        cleaned = user_text.strip().lower().rstrip('.!,?')
-        if cleaned in whisper_noise or len(cleaned) < 2:
+        cleaned = user_text.strip(' \t\n\r.!,?').lower()  # One strip pass for whitespace + punctuation
+        if cleaned in WHISPER_NOISE or len(cleaned) < 2:
             emit('status', {'message': 'Could not hear you clearly. Please try again.'})
             return
 
@@ -2197,7 +2675,8 @@ def handle_audio_message(data):
         if interrupted:
             user_text = f'[INTERRUPTED] {user_text}'
 
-        # Process and respond with audio
+        # Process and respond with audio. The session is re-read: it may have changed
+        # (text message, upload, mode switch) while Whisper was transcribing
         process_and_respond(sid, user_text)
 
     except Exception as e:
@@ -2224,15 +2703,13 @@ def handle_text_message(data):
         requested_mode = data.get('mode', 'interview') if isinstance(data, dict) else 'interview'
         if requested_mode == 'helpdesk':
             conv['mode'] = 'helpdesk'
-            conv['messages'] = [{"role": "system", "content": IT_HELPDESK_SYSTEM_PROMPT}]
+            conv['messages'] = [IT_HELPDESK_SYSTEM_MESSAGE]
         elif requested_mode == 'language':
             conv['mode'] = 'language'
-            language_code = conv.get('language', 'en')
-            language_name = SUPPORTED_LANGUAGES.get(language_code, 'English')
-            conv['messages'] = [{"role": "system", "content": LANGUAGE_SYSTEM_PROMPT.format(language=language_name)}]
+            conv['messages'] = [LANGUAGE_SYSTEM_MESSAGES.get(conv.get('language', 'en'), LANGUAGE_SYSTEM_MESSAGES['en'])]
         else:
             conv['mode'] = 'interview'
-            conv['messages'] = [{"role": "system", "content": INTERVIEW_SYSTEM_PROMPT}]
+            conv['messages'] = [INTERVIEW_SYSTEM_MESSAGE]
         save_conversation(sid, conv)
         logger.info(f"Auto-initialized mode to {conv['mode']} for {sid[:8]}")
 
@@ -2248,7 +2725,7 @@ def handle_text_message(data):
     if interrupted:
         user_text = f'[INTERRUPTED] {user_text}'
 
-    process_and_respond(sid, user_text)
+    process_and_respond(sid, user_text, conv)
 
 
 @socketio.on('reset')
@@ -2277,15 +2754,14 @@ def handle_reset(data=None):
         conv = get_conversation(sid)
         if requested_mode == 'interview':
             conv['mode'] = 'interview'
-            conv['messages'] = [{"role": "system", "content": INTERVIEW_SYSTEM_PROMPT}]
+            conv['messages'] = [INTERVIEW_SYSTEM_MESSAGE]
         elif requested_mode == 'helpdesk':
             conv['mode'] = 'helpdesk'
-            conv['messages'] = [{"role": "system", "content": IT_HELPDESK_SYSTEM_PROMPT}]
+            conv['messages'] = [IT_HELPDESK_SYSTEM_MESSAGE]
         elif requested_mode == 'language':
             conv['mode'] = 'language'
             conv['language'] = requested_language
-            language_name = SUPPORTED_LANGUAGES.get(requested_language, 'English')
-            conv['messages'] = [{"role": "system", "content": LANGUAGE_SYSTEM_PROMPT.format(language=language_name)}]
+            conv['messages'] = [LANGUAGE_SYSTEM_MESSAGES.get(requested_language, LANGUAGE_SYSTEM_MESSAGES['en'])]
         save_conversation(sid, conv)
         logger.info(f"Session {sid[:8]} reset — mode preserved as {requested_mode}")
 
@@ -2343,18 +2819,29 @@ def handle_request_tts(data):
     if not text or len(text) > 5000:
         return
 
-    try:
-        mode = conv.get('mode', 'interview')
-        voice = TTS_VOICES.get(mode, 'ash')
+    mode = conv.get('mode', 'interview')
+    voice = TTS_VOICES.get(mode, 'ash')
+
+    # COST: Replays of the same reply are served straight from cache, no background task
+    cached = get_cached_tts(text, voice, mode)
+    if cached:
+        emit('tts_audio', {'audio': cached, 'msg_id': msg_id})
+        return
+
+    # Synthesize off the handler so the socket event returns immediately
+    socketio.start_background_task(_tts_and_emit, sid, text, voice, mode, msg_id)
+
 
+def _tts_and_emit(sid, text, voice, mode, msg_id):
+    """Background task: generate on-demand TTS and emit it to the requesting client."""
+    try:
         # generate_speech already handles caching internally
-        audio_bytes = generate_speech(text, voice=voice, mode=mode)
-        audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+        audio = generate_speech(text, voice=voice, mode=mode)
 
-        emit('tts_audio', {'audio': audio_b64, 'msg_id': msg_id})
+        socketio.emit('tts_audio', {'audio': audio, 'msg_id': msg_id}, to=sid)
     except Exception as e:
         logger.error(f"request_tts error: {e}")
-        emit('status', {'message': 'Could not generate audio. Try again.'})
+        socketio.emit('status', {'message': 'Could not generate audio. Try again.'}, to=sid)
 
 
 @socketio.on('get_session_info')
@@ -2394,12 +2881,11 @@ def handle_realtime_log(data):
     if not conv.get('mode'):
         conv['mode'] = mode
         if mode == 'interview':
-            conv['messages'] = [{"role": "system", "content": INTERVIEW_SYSTEM_PROMPT}]
+            conv['messages'] = [INTERVIEW_SYSTEM_MESSAGE]
         elif mode == 'helpdesk':
-            conv['messages'] = [{"role": "system", "content": IT_HELPDESK_SYSTEM_PROMPT}]
+            conv['messages'] = [IT_HELPDESK_SYSTEM_MESSAGE]
         elif mode == 'language':
-            language_name = SUPPORTED_LANGUAGES.get(conv.get('language', 'en'), 'English')
-            conv['messages'] = [{"role": "system", "content": LANGUAGE_SYSTEM_PROMPT.format(language=language_name)}]
+            conv['messages'] = [LANGUAGE_SYSTEM_MESSAGES.get(conv.get('language', 'en'), LANGUAGE_SYSTEM_MESSAGES['en'])]
 
     conv['messages'].append({"role": role, "content": text})
     conv['exchange_count'] = conv.get('exchange_count', 0) + 1
@@ -2407,26 +2893,13 @@ def handle_realtime_log(data):
 
     # Persist to database
     if conv.get('conversation_id'):
-        db_module.log_message(
+        log_message_async(
             conv['conversation_id'], conv['exchange_count'],
             role, text
         )
 
     # Compress history if needed
-    compression_threshold = config.MEMORY_COMPRESSION_THRESHOLD
-    if len(conv['messages']) > compression_threshold:
-        system_msg = conv['messages'][0]
-        old_messages = conv['messages'][1:-(compression_threshold - 1)]
-        recent_messages = conv['messages'][-(compression_threshold - 1):]
-        summary = summarize_old_messages(old_messages)
-        if summary:
-            system_with_context = {
-                "role": "system",
-                "content": system_msg['content'] + "\n\n" + summary
-            }
-            conv['messages'] = [system_with_context] + recent_messages
-        else:
-            conv['messages'] = [system_msg] + recent_messages
+    compress_history(conv)
 
     save_conversation(sid, conv)
 
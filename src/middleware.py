@@ -13,6 +13,30 @@ logger = logging.getLogger(__name__)
 
 _config = None
 
+# Static security headers, built once and applied to every response
+CONTENT_SECURITY_POLICY = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; "
+    "style-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; "
+    "font-src 'self' https://cdnjs.cloudflare.com; "
+    "connect-src 'self' ws: wss: https://api.openai.com https://cdnjs.cloudflare.com; "
+    "media-src 'self' blob:; "
+    "img-src 'self' data:; "
+    "manifest-src 'self'; "
+    "worker-src 'self'; "
+    "frame-ancestors 'none';"
+)
+
+SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'DENY'),
+    ('X-XSS-Protection', '1; mode=block'),
+    ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+    ('Permissions-Policy', 'microphone=(self), camera=()'),
+    ('Strict-Transport-Security', 'max-age=31536000; includeSubDomains'),
+    ('Content-Security-Policy', CONTENT_SECURITY_POLICY),
+)
+
 
 def init_middleware(app, config):
     """Register middleware with the Flask app."""
@@ -50,26 +74,8 @@ def init_middleware(app, config):
                 pass
 
         # Security headers (enhanced)
-        response.headers['X-Content-Type-Options'] = 'nosniff'
-        response.headers['X-Frame-Options'] = 'DENY'
-        response.headers['X-XSS-Protection'] = '1; mode=block'
-        response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-        response.headers['Permissions-Policy'] = 'microphone=(self), camera=()'
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
-
-        # CSP
-        response.headers['Content-Security-Policy'] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; "
-            "style-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; "
-            "font-src 'self' https://cdnjs.cloudflare.com; "
-            "connect-src 'self' ws: wss: https://api.openai.com https://cdnjs.cloudflare.com; "
-            "media-src 'self' blob:; "
-            "img-src 'self' data:; "
-            "manifest-src 'self'; "
-            "worker-src 'self'; "
-            "frame-ancestors 'none';"
-        )
+        for name, value in SECURITY_HEADERS:
+            response.headers[name] = value
 
         return response
 
@@ -8,13 +8,28 @@ Blueprint Section 8: State Management — Redis for ephemeral session state.
 """
 import json
 import time
+import base64
 import logging
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Union
+
+try:
+    import orjson  # Optional: C JSON codec for session payloads
+except ImportError:
+    orjson = None
+
+_ORJSON_SESSION_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    if orjson is not None else 0
+)
 
 logger = logging.getLogger(__name__)
 
-# In-memory fallback store
-_memory_store: Dict[str, Dict] = {}
+# In-memory fallback store, kept in last-activity order (oldest first) so
+# stale sessions can be swept from the front without scanning the whole dict
+_memory_store: "OrderedDict[str, Dict]" = OrderedDict()
+_memory_writes = 0
+_MEMORY_SWEEP_EVERY = 500  # writes between opportunistic stale-session sweeps
 _redis_client = None
 _redis_available = False
 _config = None
@@ -42,6 +57,7 @@ def init_redis(config):
         # Test connection
         _redis_client.ping()
         _redis_available = True
+        _apply_memory_policy(config)
         logger.info(f"[Redis] Connected to Redis at {config.REDIS_URL.split('@')[-1] if '@' in config.REDIS_URL else config.REDIS_URL}")
         return True
     except ImportError:
@@ -53,6 +69,23 @@ def init_redis(config):
         return False
 
 
+def _apply_memory_policy(config):
+    """Set maxmemory and the eviction policy if configured.
+    Managed Redis services often disallow CONFIG; that only logs a warning."""
+    settings = {
+        'maxmemory': config.REDIS_MAXMEMORY,
+        'maxmemory-policy': config.REDIS_MAXMEMORY_POLICY,
+    }
+    for name, value in settings.items():
+        if not value:
+            continue
+        try:
+            _redis_client.config_set(name, value)
+            logger.info(f"[Redis] {name} set to {value}")
+        except Exception as e:
+            logger.warning(f"[Redis] Could not set {name} ({e}) — configure it on the server instead")
+
+
 def _key(sid: str) -> str:
     """Generate Redis key with prefix."""
     prefix = _config.REDIS_PREFIX if _config else 'ivprep:'
@@ -64,6 +97,60 @@ def _ttl() -> int:
     return _config.REDIS_SESSION_TTL if _config else 7200
 
 
+# ============================================================
+# Shared Messages (compact Redis encoding)
+# ============================================================
+
+# Process-wide message dicts (e.g. per-mode system prompts) stored in Redis as a
+# short {"ref": name} instead of their full text. The helpdesk prompt alone is
+# ~75KB, which was otherwise serialized, sent and parsed on every turn.
+_shared_messages: Dict[str, Dict] = {}
+_shared_message_refs: Dict[int, str] = {}  # id(message) -> name
+
+
+def register_shared_messages(messages: Dict[str, Dict]):
+    """Register immutable message dicts that sessions may reference by identity."""
+    for name, message in messages.items():
+        _shared_messages[name] = message
+        _shared_message_refs[id(message)] = name
+
+
+def _dumps_session(session_data: Dict[str, Any]) -> Union[str, bytes]:
+    """Serialize a session, replacing shared messages with references."""
+    messages = session_data.get('messages')
+    if messages and _shared_message_refs:
+        session_data = dict(session_data)
+        session_data['messages'] = [
+            {'ref': _shared_message_refs[id(m)]} if id(m) in _shared_message_refs else m
+            for m in messages
+        ]
+    if orjson is not None:
+        # Pass datetimes and dataclasses to default=str, as json.dumps does, so stored
+        # values don't change format (orjson would otherwise write RFC 3339 / objects)
+        try:
+            return orjson.dumps(session_data, default=str, option=_ORJSON_SESSION_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass  # orjson rejects str that isn't valid UTF-8 (lone surrogates); json escapes it
+    return json.dumps(session_data, default=str)
+
+
+def _loads_session(data: str) -> Dict[str, Any]:
+    """Parse a session, resolving shared-message references back to the shared dicts."""
+    try:
+        session = orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError:
+        if orjson is None:
+            raise
+        session = json.loads(data)  # Escaped lone surrogates, written by the json fallback above
+    messages = session.get('messages')
+    if messages:
+        session['messages'] = [
+            _shared_messages.get(m['ref'], m) if 'ref' in m else m
+            for m in messages
+        ]
+    return session
+
+
 # ============================================================
 # Core Session Operations
 # ============================================================
@@ -72,20 +159,42 @@ def get_session(sid: str) -> Optional[Dict[str, Any]]:
     """Get session data. Returns None if not found."""
     if _redis_available:
         try:
-            data = _redis_client.get(_key(sid))
+            # Read and refresh the TTL in one round-trip (EXPIRE on a missing key is a no-op)
+            key = _key(sid)
+            pipe = _redis_client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.expire(key, _ttl())
+            data, _ = pipe.execute()
             if data:
-                session = json.loads(data)
+                session = _loads_session(data)
                 session['last_activity'] = time.time()
-                # Refresh TTL on access
-                _redis_client.expire(_key(sid), _ttl())
                 return session
             return None
         except Exception as e:
             logger.error(f"[Redis] get_session error: {e}")
             # Fallback to memory
-            return _memory_store.get(sid)
+            return _touch_memory_session(sid)
     else:
-        return _memory_store.get(sid)
+        return _touch_memory_session(sid)
+
+
+def _touch_memory_session(sid: str) -> Optional[Dict[str, Any]]:
+    """Get an in-memory session and mark it most recently active."""
+    session = _memory_store.get(sid)
+    if session is not None:
+        session['last_activity'] = time.time()
+        _memory_store.move_to_end(sid)
+    return session
+
+
+def _store_memory_session(sid: str, session_data: Dict[str, Any]):
+    """Store an in-memory session at the most-recent end; sweep stale ones periodically."""
+    global _memory_writes
+    _memory_store[sid] = session_data
+    _memory_store.move_to_end(sid)
+    _memory_writes += 1
+    if _memory_writes % _MEMORY_SWEEP_EVERY == 0:
+        _sweep_memory_sessions(_config.SESSION_TIMEOUT if _config else 3600)
 
 
 def set_session(sid: str, session_data: Dict[str, Any]):
@@ -96,13 +205,13 @@ def set_session(sid: str, session_data: Dict[str, Any]):
             _redis_client.setex(
                 _key(sid),
                 _ttl(),
-                json.dumps(session_data, default=str)
+                _dumps_session(session_data)
             )
         except Exception as e:
             logger.error(f"[Redis] set_session error: {e}")
-            _memory_store[sid] = session_data
+            _store_memory_session(sid, session_data)
     else:
-        _memory_store[sid] = session_data
+        _store_memory_session(sid, session_data)
 
 
 def delete_session(sid: str):
@@ -182,12 +291,20 @@ def cleanup_stale_sessions(timeout: int = 3600):
         # Redis handles TTL-based expiration automatically
         return 0
 
-    now = time.time()
-    stale = [sid for sid, conv in _memory_store.items()
-             if now - conv.get('last_activity', 0) > timeout]
-    for sid in stale:
-        _memory_store.pop(sid, None)
-    return len(stale)
+    return _sweep_memory_sessions(timeout)
+
+
+def _sweep_memory_sessions(timeout: int) -> int:
+    """Pop stale sessions off the front of the in-memory store (oldest first)."""
+    cutoff = time.time() - timeout
+    removed = 0
+    while _memory_store:
+        sid, conv = next(iter(_memory_store.items()))
+        if conv.get('last_activity', 0) >= cutoff:
+            break
+        _memory_store.popitem(last=False)
+        removed += 1
+    return removed
 
 
 def get_all_session_ids() -> list:
@@ -206,55 +323,69 @@ def get_all_session_ids() -> list:
 # TTS Cache (Redis-backed)
 # ============================================================
 
-_tts_cache_memory: Dict[str, Dict] = {}
+# Memory fallback is an LRU (least recently used first) with the same idle TTL as Redis
+_tts_cache_memory: "OrderedDict[str, Dict]" = OrderedDict()
+_TTS_CACHE_TTL = 3600  # 1 hour, refreshed on every hit
 _tts_cache_hits = 0
 _tts_cache_misses = 0
 
 
-def get_tts_cache(key: str) -> Optional[str]:
-    """Get TTS audio from cache. Returns base64 string or None."""
+def _tts_key(key: str) -> str:
+    """Redis key for a TTS cache entry. 'v2' marks BLAKE3/BLAKE2b digests so
+    entries written under the old MD5 scheme are never read and simply expire."""
+    prefix = _config.REDIS_PREFIX if _config else 'ivprep:'
+    return f"{prefix}tts:v2:{key}"
+
+
+def get_tts_cache(key: str) -> Optional[bytes]:
+    """Get TTS audio from cache. Returns audio bytes or None.
+    Redis holds base64 text (the connection uses decode_responses); memory holds raw bytes."""
     global _tts_cache_hits
     if _redis_available and _config and _config.TTS_CACHE_BACKEND == 'redis':
         try:
-            prefix = _config.REDIS_PREFIX if _config else 'ivprep:'
-            data = _redis_client.get(f"{prefix}tts:{key}")
+            data = _redis_client.get(_tts_key(key))
             if data:
                 _tts_cache_hits += 1
-                _redis_client.expire(f"{prefix}tts:{key}", 3600)  # Refresh 1hr TTL
-                return data
+                _redis_client.expire(_tts_key(key), _TTS_CACHE_TTL)  # Refresh 1hr TTL
+                return base64.b64decode(data)
         except Exception as e:
             logger.error(f"[Redis] TTS cache get error: {e}")
 
     # Memory fallback
-    if key in _tts_cache_memory:
-        _tts_cache_memory[key]['last_used'] = time.time()
-        _tts_cache_hits += 1
-        return _tts_cache_memory[key]['audio_b64']
-    return None
+    entry = _tts_cache_memory.get(key)
+    if entry is None:
+        return None
+    now = time.time()
+    if now - entry['last_used'] > _TTS_CACHE_TTL:
+        del _tts_cache_memory[key]
+        return None
+    entry['last_used'] = now
+    _tts_cache_memory.move_to_end(key)
+    _tts_cache_hits += 1
+    return entry['audio']
 
 
-def set_tts_cache(key: str, audio_b64: str, max_size: int = 200):
+def set_tts_cache(key: str, audio: bytes, max_size: int = 200):
     """Store TTS audio in cache."""
     global _tts_cache_misses
     _tts_cache_misses += 1
 
     if _redis_available and _config and _config.TTS_CACHE_BACKEND == 'redis':
         try:
-            prefix = _config.REDIS_PREFIX if _config else 'ivprep:'
-            _redis_client.setex(f"{prefix}tts:{key}", 3600, audio_b64)
+            _redis_client.setex(_tts_key(key), _TTS_CACHE_TTL, base64.b64encode(audio).decode('ascii'))
             return
         except Exception as e:
             logger.error(f"[Redis] TTS cache set error: {e}")
 
-    # Memory fallback
-    if len(_tts_cache_memory) >= max_size:
-        oldest_key = min(_tts_cache_memory, key=lambda k: _tts_cache_memory[k]['last_used'])
-        del _tts_cache_memory[oldest_key]
+    # Memory fallback: evict least recently used entries (front of the OrderedDict)
+    _tts_cache_memory.pop(key, None)
+    while len(_tts_cache_memory) >= max_size:
+        _tts_cache_memory.popitem(last=False)
 
     _tts_cache_memory[key] = {
-        'audio_b64': audio_b64,
+        'audio': audio,
         'last_used': time.time(),
-        'size': len(audio_b64)
+        'size': len(audio)
     }
 
 
@@ -288,9 +419,12 @@ def check_rate_limit(sid: str, rpm: int = 15, rph: int = 200) -> bool:
 
 
 def _check_rate_limit_redis(sid: str, rpm: int, rph: int) -> bool:
-    """Redis-based sliding window rate limiting."""
+    """Redis-based sliding window rate limiting.
+    Records the request and counts in one round-trip; a rejected request is
+    taken back out, so only over-limit turns pay a second one."""
     prefix = _config.REDIS_PREFIX if _config else 'ivprep:'
     now = time.time()
+    member = str(now)
     pipe = _redis_client.pipeline()
 
     minute_key = f"{prefix}rl:m:{sid}"
@@ -300,25 +434,25 @@ def _check_rate_limit_redis(sid: str, rpm: int, rph: int) -> bool:
     pipe.zremrangebyscore(minute_key, 0, now - 60)
     pipe.zremrangebyscore(hour_key, 0, now - 3600)
 
-    # Count entries
+    # Add current request, then count (the count includes it)
+    pipe.zadd(minute_key, {member: now})
+    pipe.zadd(hour_key, {member: now})
     pipe.zcard(minute_key)
     pipe.zcard(hour_key)
+    pipe.expire(minute_key, 60)
+    pipe.expire(hour_key, 3600)
 
     results = pipe.execute()
-    minute_count = results[2]
-    hour_count = results[3]
-
-    if minute_count >= rpm or hour_count >= rph:
+    minute_count = results[4]
+    hour_count = results[5]
+
+    if minute_count > rpm or hour_count > rph:
+        pipe = _redis_client.pipeline()
+        pipe.zrem(minute_key, member)
+        pipe.zrem(hour_key, member)
+        pipe.execute()
         return False
 
-    # Add current request
-    pipe2 = _redis_client.pipeline()
-    pipe2.zadd(minute_key, {str(now): now})
-    pipe2.zadd(hour_key, {str(now): now})
-    pipe2.expire(minute_key, 60)
-    pipe2.expire(hour_key, 3600)
-    pipe2.execute()
-
     return True
 
 
@@ -365,12 +499,17 @@ def get_redis_health() -> Dict:
         return {'status': 'unhealthy', 'message': 'Redis connection failed'}
 
     try:
-        info = _redis_client.info('server')
+        # One round-trip for all three INFO sections
+        pipe = _redis_client.pipeline(transaction=False)
+        pipe.info('server')
+        pipe.info('clients')
+        pipe.info('memory')
+        server, clients, memory = pipe.execute()
         return {
             'status': 'healthy',
-            'version': info.get('redis_version', 'unknown'),
-            'connected_clients': _redis_client.info('clients').get('connected_clients', 0),
-            'used_memory_human': _redis_client.info('memory').get('used_memory_human', 'unknown'),
+            'version': server.get('redis_version', 'unknown'),
+            'connected_clients': clients.get('connected_clients', 0),
+            'used_memory_human': memory.get('used_memory_human', 'unknown'),
         }
     except Exception as e:
         return {'status': 'unhealthy', 'message': str(e)}
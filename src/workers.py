@@ -8,9 +8,9 @@ Requires Redis as message broker. Gracefully disabled when CELERY_BROKER_URL is
 """
 import os
 import time
+import io
 import base64
 import logging
-import tempfile
 
 logger = logging.getLogger(__name__)
 
@@ -142,27 +142,22 @@ def register_tasks(celery_app):
             }
             ext = mime_ext_map.get(mime_type.lower().strip(), '.webm')
 
-            with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-                tmp.write(audio_bytes)
-                tmp_path = tmp.name
-
-            try:
-                with open(tmp_path, 'rb') as f:
-                    kwargs = {"model": "whisper-1", "file": f}
-                    if language and language != 'en':
-                        kwargs["language"] = language
-                    transcript = client.audio.transcriptions.create(**kwargs)
-                
-                latency_ms = int((time.time() - start_time) * 1000)
-                logger.info(f"[STT Worker] Transcribed {len(audio_bytes)} bytes in {latency_ms}ms")
-                
-                return {
-                    'text': transcript.text,
-                    'latency_ms': latency_ms,
-                    'audio_size': len(audio_bytes),
-                }
-            finally:
-                os.unlink(tmp_path)
+            # Upload straight from memory; the SDK infers the format from the file name
+            audio_file = io.BytesIO(audio_bytes)
+            audio_file.name = f"audio{ext}"
+            kwargs = {"model": "whisper-1", "file": audio_file}
+            if language and language != 'en':
+                kwargs["language"] = language
+            transcript = client.audio.transcriptions.create(**kwargs)
+
+            latency_ms = int((time.time() - start_time) * 1000)
+            logger.info(f"[STT Worker] Transcribed {len(audio_bytes)} bytes in {latency_ms}ms")
+
+            return {
+                'text': transcript.text,
+                'latency_ms': latency_ms,
+                'audio_size': len(audio_bytes),
+            }
 
         except Exception as e:
             logger.error(f"[STT Worker] Error: {e}")
@@ -0,0 +1,13 @@
+"""Shared test setup: make src/ importable and keep the app offline and in-memory."""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ['OPENAI_WARMUP'] = 'false'
+# The app creates its sqlite user database at import; keep it out of the repo's data/
+os.environ['USER_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='ivprep-test-'), 'users.db')
+for var in ('REDIS_URL', 'DATABASE_URL', 'CELERY_BROKER_URL', 'SOCKETIO_MESSAGE_QUEUE'):
+    os.environ.pop(var, None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,103 @@
+"""compress_history keeps the stored history within its message and token limits."""
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+SYSTEM = {'role': 'system', 'content': 'system prompt'}
+
+
+def history_tokens(conv):
+    return sum(app.count_tokens(msg['content']) + 4 for msg in conv['messages'][1:])
+
+
+def make_conv(count, words):
+    messages = [SYSTEM]
+    for i in range(count):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        messages.append({'role': role, 'content': f'turn {i} ' + 'word ' * words})
+    return {'messages': messages, 'summary': ''}
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(app.config, 'MEMORY_COMPRESSION_THRESHOLD', 21)
+    monkeypatch.setattr(app.config, 'HISTORY_TOKEN_BUDGET', 500)
+
+
+def test_oldest_messages_are_evicted_past_threshold(limits):
+    conv = make_conv(40, words=1)
+    last = conv['messages'][-1]
+
+    app.compress_history(conv)
+
+    assert len(conv['messages']) <= app.config.MEMORY_COMPRESSION_THRESHOLD
+    assert history_tokens(conv) <= app.config.HISTORY_TOKEN_BUDGET
+    assert conv['messages'][0] is SYSTEM
+    assert conv['messages'][-1] is last
+    assert conv['summary'].startswith('User said: turn 0')
+
+
+def test_long_messages_are_evicted_to_fit_token_budget(limits):
+    conv = make_conv(10, words=100)  # under the message threshold, well over the token budget
+    last = conv['messages'][-1]
+
+    app.compress_history(conv)
+
+    assert history_tokens(conv) <= app.config.HISTORY_TOKEN_BUDGET
+    assert conv['messages'][0] is SYSTEM
+    assert conv['messages'][-1] is last
+    assert conv['summary'].startswith('User said: turn 0')
+
+
+def test_history_within_limits_is_untouched(limits):
+    conv = make_conv(4, words=5)
+    before = list(conv['messages'])
+    app.compress_history(conv)
+    assert conv['messages'] == before
+    assert conv['summary'] == ''
+
+
+def test_latest_message_kept_even_if_alone_over_budget(limits):
+    conv = make_conv(3, words=2000)
+    app.compress_history(conv)
+    assert len(conv['messages']) == 2
+    assert conv['messages'][1]['content'].startswith('turn 2')
+
+
+def test_summary_is_capped(limits):
+    conv = make_conv(200, words=30)
+    app.compress_history(conv)
+    assert len(conv['summary']) <= app.SUMMARY_MAX_CHARS
+    assert history_tokens(conv) <= app.config.HISTORY_TOKEN_BUDGET
+
+
+class FakeEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+def test_failed_encoding_load_is_retried_and_estimates_are_not_cached(monkeypatch):
+    attempts = []
+
+    def encoding_for_model(model):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise OSError('download failed')
+        return FakeEncoding()
+
+    monkeypatch.setattr(app, 'tiktoken', SimpleNamespace(encoding_for_model=encoding_for_model))
+    monkeypatch.setattr(app, '_token_encoding', None)
+    monkeypatch.setattr(app, '_token_encoding_retry_at', 0.0)
+    app._count_encoded_tokens.cache_clear()
+
+    text = 'one two three four five six seven eight'
+    assert app.count_tokens(text) == len(text) // 4 + 1
+    assert app.count_tokens(text) == len(text) // 4 + 1
+    assert len(attempts) == 1  # no retry until the interval passes
+
+    monkeypatch.setattr(app, '_token_encoding_retry_at', 0.0)
+    assert app.count_tokens(text) == 8
+    assert len(attempts) == 2
+    app._count_encoded_tokens.cache_clear()
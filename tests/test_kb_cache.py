@@ -0,0 +1,28 @@
+"""KB text snapshot is reused only for the same xlsx mtime and cache format."""
+import pytest
+
+import app
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / 'kb.cache.json'
+    monkeypatch.setattr(app, 'KB_CACHE_PATH', str(path))
+    return path
+
+
+def test_snapshot_reused_for_same_mtime(cache_path):
+    app._write_kb_cache(123, 'kb text')
+    assert app._read_kb_cache(123) == 'kb text'
+    assert app._read_kb_cache(456) is None
+
+
+def test_snapshot_from_other_format_is_ignored(cache_path, monkeypatch):
+    app._write_kb_cache(123, 'kb text')
+    monkeypatch.setattr(app, '_KB_CACHE_FORMAT', 'other')
+    assert app._read_kb_cache(123) is None
+
+
+def test_snapshot_without_format_is_ignored(cache_path):
+    cache_path.write_text('{"mtime": 123, "kb_text": "kb text"}', encoding='utf-8')
+    assert app._read_kb_cache(123) is None
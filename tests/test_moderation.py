@@ -0,0 +1,96 @@
+"""Moderation verdict cache (TTL + LRU) and request batching."""
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import eventlet
+import pytest
+
+import app
+
+
+@pytest.fixture
+def moderation_calls(monkeypatch):
+    """Fresh cache and a fake moderation request that records each text sent."""
+    calls = []
+
+    def fake_request(text):
+        calls.append(text)
+        return SimpleNamespace(flagged=False, categories=SimpleNamespace())
+
+    monkeypatch.setattr(app, '_moderation_cache', OrderedDict())
+    monkeypatch.setattr(app, '_request_moderation', fake_request)
+    monkeypatch.setattr(app.config, 'MODERATION_CACHE_TTL', 3600)
+    monkeypatch.setattr(app.config, 'MODERATION_CACHE_MAX_SIZE', 2)
+    return calls
+
+
+def test_repeat_text_is_served_from_cache(moderation_calls):
+    assert app.moderate_content('tell me about your leadership style') == (False, [])
+    assert app.moderate_content('Tell me  about your\tleadership style') == (False, [])
+    assert len(moderation_calls) == 1
+
+
+def test_expired_entry_is_requested_again(moderation_calls):
+    text = 'tell me about your leadership style'
+    app.moderate_content(text)
+    key = app._moderation_cache_key(text)
+    _, flagged, categories = app._moderation_cache[key]
+    app._moderation_cache[key] = (time.time() - 1, flagged, categories)
+
+    app.moderate_content(text)
+    assert len(moderation_calls) == 2
+    assert app._moderation_cache[key][0] > time.time()
+
+
+def test_least_recently_used_entry_is_evicted(moderation_calls):
+    first, second, third = 'first long message', 'second long message', 'third long message'
+    app.moderate_content(first)
+    app.moderate_content(second)
+    app.moderate_content(first)  # hit: first becomes most recently used
+    app.moderate_content(third)  # cache is full: evicts second
+
+    assert len(app._moderation_cache) == 2
+    assert app._moderation_cache_key(first) in app._moderation_cache
+    assert app._moderation_cache_key(second) not in app._moderation_cache
+
+    app.moderate_content(first)
+    assert len(moderation_calls) == 3
+    app.moderate_content(second)
+    assert len(moderation_calls) == 4
+
+
+def test_concurrent_requests_share_one_batched_call(monkeypatch):
+    batches = []
+
+    def create(input):
+        batches.append(list(input))
+        return SimpleNamespace(results=[SimpleNamespace(flagged=text == 'bad', text=text) for text in input])
+
+    fake_client = SimpleNamespace(moderations=SimpleNamespace(create=create))
+    monkeypatch.setattr(app, 'client', fake_client)
+    monkeypatch.setattr(app, '_moderation_pending', [])
+    monkeypatch.setattr(app, '_moderation_flusher', None)
+    monkeypatch.setattr(app.config, 'MODERATION_BATCH_MAX', 32)
+
+    texts = ['one', 'bad', 'three']
+    threads = [eventlet.spawn(app._request_moderation, text) for text in texts]
+    results = [thread.wait() for thread in threads]
+
+    assert batches == [texts]
+    assert [result.text for result in results] == texts
+    assert [result.flagged for result in results] == [False, True, False]
+
+
+def test_batch_failure_reaches_every_waiter(monkeypatch):
+    def create(input):
+        raise RuntimeError('moderation down')
+
+    monkeypatch.setattr(app, 'client', SimpleNamespace(moderations=SimpleNamespace(create=create)))
+    monkeypatch.setattr(app, '_moderation_pending', [])
+    monkeypatch.setattr(app, '_moderation_flusher', None)
+
+    threads = [eventlet.spawn(app._request_moderation, text) for text in ('a', 'b')]
+    for thread in threads:
+        with pytest.raises(RuntimeError):
+            thread.wait()
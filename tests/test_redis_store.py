@@ -0,0 +1,94 @@
+"""Session serialization: shared message refs and json.dumps-compatible output."""
+import datetime
+import json
+
+import pytest
+
+import redis_store
+
+SYSTEM_MESSAGE = {'role': 'system', 'content': 'You are a test prompt. ' * 50}
+
+
+@pytest.fixture(autouse=True)
+def shared_messages(monkeypatch):
+    monkeypatch.setattr(redis_store, '_shared_messages', {})
+    monkeypatch.setattr(redis_store, '_shared_message_refs', {})
+    redis_store.register_shared_messages({'system:test': SYSTEM_MESSAGE})
+
+
+def test_round_trip_resolves_shared_message_to_same_object():
+    session = {
+        'messages': [SYSTEM_MESSAGE, {'role': 'user', 'content': 'héllo'}],
+        'exchange_count': 3,
+        'summary': '',
+    }
+    data = redis_store._dumps_session(session)
+
+    assert 'You are a test prompt' not in (data.decode() if isinstance(data, bytes) else data)
+    loaded = redis_store._loads_session(data)
+    assert loaded['messages'][0] is SYSTEM_MESSAGE
+    assert loaded['messages'][1] == {'role': 'user', 'content': 'héllo'}
+    assert loaded['exchange_count'] == 3
+    # Serializing must not rewrite the caller's session
+    assert session['messages'][0] is SYSTEM_MESSAGE
+
+
+def test_unregistered_message_with_equal_content_is_stored_inline():
+    copy = dict(SYSTEM_MESSAGE)
+    loaded = redis_store._loads_session(redis_store._dumps_session({'messages': [copy]}))
+    assert loaded['messages'] == [copy]
+    assert loaded['messages'][0] is not SYSTEM_MESSAGE
+
+
+def test_output_matches_json_dumps_for_datetimes_and_int_keys():
+    session = {
+        'messages': [],
+        'started': datetime.datetime(2026, 10, 16, 7, 0, tzinfo=datetime.timezone.utc),
+        'day': datetime.date(2026, 1, 2),
+        'scores': {1: 'a'},
+    }
+    expected = json.loads(json.dumps(session, default=str))
+    assert json.loads(redis_store._dumps_session(session)) == expected
+
+
+def test_sessions_written_by_json_dumps_still_load():
+    legacy = json.dumps({'messages': [{'ref': 'system:test'}, {'role': 'user', 'content': 'hi'}]})
+    loaded = redis_store._loads_session(legacy)
+    assert loaded['messages'][0] is SYSTEM_MESSAGE
+
+
+def test_lone_surrogate_round_trips():
+    # e.g. a transcript or pasted text split mid surrogate pair; orjson rejects both ways
+    session = {'messages': [SYSTEM_MESSAGE, {'role': 'user', 'content': 'half \ud83d pair'}]}
+    loaded = redis_store._loads_session(redis_store._dumps_session(session))
+    assert loaded['messages'][0] is SYSTEM_MESSAGE
+    assert loaded['messages'][1]['content'] == 'half \ud83d pair'
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_store, '_redis_client', client)
+    monkeypatch.setattr(redis_store, '_redis_available', True)
+    monkeypatch.setattr(redis_store, '_config', None)
+    return client
+
+
+def test_get_session_refreshes_ttl_in_same_pipeline(fake_redis):
+    redis_store.set_session('sid', {'messages': [SYSTEM_MESSAGE]})
+    fake_redis.expire(redis_store._key('sid'), 5)
+
+    session = redis_store.get_session('sid')
+
+    assert session['messages'][0] is SYSTEM_MESSAGE
+    assert fake_redis.ttl(redis_store._key('sid')) > 5
+    assert redis_store.get_session('missing') is None
+
+
+def test_rate_limit_rejections_are_not_counted(fake_redis):
+    results = [redis_store.check_rate_limit('sid', rpm=3, rph=10) for _ in range(5)]
+
+    assert results == [True, True, True, False, False]
+    assert fake_redis.zcard('ivprep:rl:m:sid') == 3
+    assert fake_redis.zcard('ivprep:rl:h:sid') == 3
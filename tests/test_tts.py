@@ -0,0 +1,60 @@
+"""Single-flight TTS: concurrent requests for the same audio share one synthesis."""
+import eventlet
+import pytest
+
+import app
+
+
+@pytest.fixture
+def synth_calls(monkeypatch):
+    calls = []
+
+    def fake_synthesize(text, voice, mode, emotional_tone):
+        calls.append(text)
+        eventlet.sleep(0.01)  # let the other callers arrive while this one is in flight
+        if text == 'fail':
+            raise RuntimeError('tts down')
+        return f'audio:{text}'.encode()
+
+    monkeypatch.setattr(app, '_synthesize_speech', fake_synthesize)
+    monkeypatch.setattr(app, 'get_cached_tts', lambda *args, **kwargs: None)
+    monkeypatch.setattr(app, 'store_tts_cache', lambda *args, **kwargs: None)
+    monkeypatch.setattr(app, '_tts_inflight', {})
+    return calls
+
+
+def test_concurrent_callers_share_one_synthesis(synth_calls):
+    threads = [eventlet.spawn(app.generate_speech, 'Hello there.', 'marin', 'interview') for _ in range(5)]
+    results = [thread.wait() for thread in threads]
+
+    assert synth_calls == ['Hello there.']
+    assert results == [b'audio:Hello there.'] * 5
+    assert app._tts_inflight == {}
+
+
+def test_different_text_is_not_shared(synth_calls):
+    threads = [eventlet.spawn(app.generate_speech, text, 'marin', 'interview') for text in ('One.', 'Two.')]
+    assert [thread.wait() for thread in threads] == [b'audio:One.', b'audio:Two.']
+    assert sorted(synth_calls) == ['One.', 'Two.']
+
+
+def test_failure_reaches_every_waiter_and_clears_inflight(synth_calls):
+    threads = [eventlet.spawn(app.generate_speech, 'fail', 'marin', 'interview') for _ in range(3)]
+    for thread in threads:
+        with pytest.raises(RuntimeError):
+            thread.wait()
+    assert synth_calls == ['fail']
+    assert app._tts_inflight == {}
+
+
+def test_killed_synthesis_hands_over_to_waiter(synth_calls):
+    leader = eventlet.spawn(app.generate_speech, 'Hello there.', 'marin', 'interview')
+    eventlet.sleep(0)  # leader is now synthesizing
+    waiter = eventlet.spawn(app.generate_speech, 'Hello there.', 'marin', 'interview')
+    eventlet.sleep(0)  # waiter is now waiting on the leader
+
+    leader.kill()
+
+    assert waiter.wait() == b'audio:Hello there.'
+    assert synth_calls == ['Hello there.', 'Hello there.']
+    assert app._tts_inflight == {}
@@ -0,0 +1,35 @@
+"""Upload size limits apply to the file, not the multipart request around it."""
+import io
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def upload(client, data, filename='cv.txt'):
+    return client.post(
+        '/api/upload-document',
+        data={'type': 'cv', 'file': (io.BytesIO(data), filename)},
+        content_type='multipart/form-data',
+    )
+
+
+def test_file_at_size_limit_is_accepted(client):
+    response = upload(client, b'a' * app.MAX_UPLOAD_SIZE)
+    assert response.status_code == 200
+    assert response.get_json()['text'].endswith('...[truncated]')
+
+
+def test_file_over_size_limit_is_rejected(client):
+    response = upload(client, b'a' * (app.MAX_UPLOAD_SIZE + 1))
+    assert response.status_code == 413
+
+
+def test_request_far_over_limit_is_rejected_from_content_length(client):
+    response = upload(client, b'a' * (app.MAX_UPLOAD_REQUEST_SIZE + 1))
+    assert response.status_code == 413